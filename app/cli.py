@@ -0,0 +1,250 @@
+"""Command-line entry point for unattended jobs (run from the repository root).
+
+  python -m app.cli ingest notes/ more/notes.md --workers 8
+  python -m app.cli reindex                     # re-embed after changing EMBED_PROVIDER / model
+  python -m app.cli rebuild-index lexical       # rebuild a side index from the stored rows
+  python -m app.cli search "微分方程式" --top-k 10
+  python -m app.cli map "線形代数" --out map.html --json map.json   # no query: cluster overview
+  python -m app.cli quiz "確率" --n 5 --out quiz.json
+
+Uses the same services, settings (.env) and data directories as the Streamlit app.
+"""
+from typing import Dict, Iterator, List, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import itertools
+import json
+import os
+import pathlib
+import sys
+import time
+
+from .services import graph, vector_store
+from .services.context import build_context
+from .services.ingest import checkpoint_for, run_ingest
+from .services.insights import generate_sharded
+from .utils.text_clean import clean_text
+
+DATA_RAW = "app/data/raw"
+PERSIST_DIR = "app/data/chroma"
+NOTE_SUFFIXES = (".txt", ".md")
+
+
+def _walk(paths: List[str], suffixes: Tuple[str, ...]) -> Iterator[Tuple[str, pathlib.Path]]:
+    """(name, path) for every note file under `paths`; names are relative to the given root."""
+    for root in paths:
+        p = pathlib.Path(root)
+        if p.is_file():
+            yield p.name, p
+            continue
+        for dirpath, dirnames, filenames in os.walk(p):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for fn in sorted(filenames):
+                if fn.lower().endswith(suffixes):
+                    f = pathlib.Path(dirpath) / fn
+                    yield f.relative_to(p).as_posix(), f
+
+
+class _Progress:
+    """Print a status line at most every `every` seconds (and always for the last one)."""
+
+    def __init__(self, every: float):
+        self.every = every
+        self.last = 0.0
+
+    def __call__(self, line: str, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self.last >= self.every:
+            self.last = now
+            print(line, file=sys.stderr, flush=True)
+
+
+def _results(query: str, top_k: int, mode: str) -> List[Dict]:
+    return vector_store.search(query, top_k=top_k, mode=mode) if query else vector_store.overview(top_k)
+
+
+def cmd_ingest(args) -> None:
+    files = list(_walk(args.paths, tuple(args.suffix)))
+    # Re-running the same command after a failure resumes it
+    checkpoint = args.checkpoint or checkpoint_for(os.path.abspath(p) for p in args.paths)
+    show = _Progress(args.progress_every)
+    t0 = time.perf_counter()
+
+    def _show(p: Dict[str, int], force: bool = False) -> None:
+        show(
+            f"read {p['read']}/{len(files)} (skipped {p['skipped']}, duplicates {p['duplicates']}, "
+            f"near {p['near_duplicates']}) chunks {p['chunks']} embedded {p['embedded']} committed {p['committed']}",
+            force,
+        )
+
+    stats = run_ingest(
+        files,
+        args.raw_dir,
+        clean=clean_text,
+        on_progress=_show,
+        checkpoint_path=None if args.no_checkpoint else checkpoint,
+        batch_chunks=args.batch_chunks,
+        workers=args.workers,
+    )
+    _show(stats, force=True)
+    print(json.dumps({**stats, "files": len(files), "seconds": round(time.perf_counter() - t0, 2)}, ensure_ascii=False))
+
+
+def cmd_reindex(args) -> None:
+    show = _Progress(args.progress_every)
+    t0 = time.perf_counter()
+    n = vector_store.reindex(
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint,
+        on_progress=lambda done, total: show(f"re-embedded {done}/{total}", done >= total),
+    )
+    print(json.dumps({"reembedded": n, "rows": vector_store.get_count(), "seconds": round(time.perf_counter() - t0, 2)}))
+
+
+def cmd_rebuild_index(args) -> None:
+    rebuild = {
+        "knn": vector_store.rebuild_knn_index,
+        "lexical": vector_store.rebuild_lexical_index,
+        "overview": vector_store.rebuild_overview_index,
+    }
+    out = {}
+    for name in (sorted(rebuild) if args.index == "all" else [args.index]):
+        t0 = time.perf_counter()
+        out[name] = {"rows": rebuild[name](), "seconds": round(time.perf_counter() - t0, 2)}
+        print(f"rebuilt {name}: {out[name]['rows']} rows", file=sys.stderr, flush=True)
+    print(json.dumps(out))
+
+
+def cmd_search(args) -> None:
+    rows = []
+    for r in vector_store.search(args.query, top_k=args.top_k, mode=args.mode):
+        meta = r.get("meta", {}) or {}
+        rows.append({
+            "id": r["id"],
+            "parent_id": r.get("parent_id"),
+            "title": meta.get("title", ""),
+            "score": r.get("score"),
+            "text": (r.get("text") or "")[: args.snippet_chars],
+        })
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    for i, r in enumerate(rows, 1):
+        print(f"{i:>3}. {r['title']}  ({r['id']}, score={r['score']:.3f})")
+        print(f"     {r['text'].replace(chr(10), ' ')}")
+
+
+def cmd_map(args) -> None:
+    if args.all:
+        results = list(itertools.islice(vector_store.iter_items(), args.max_nodes))
+    else:
+        results = _results(args.query, args.top_k, args.mode)
+    if not results:
+        sys.exit("no rows to map")
+    params = dict(
+        sim_threshold=args.sim_threshold,
+        knn=args.knn,
+        use_index=args.use_index or args.all,
+        layout=args.layout,
+    )
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(graph.build_graph(results, assets=args.assets, **params))
+        print(f"map: {len(results)} nodes -> {args.out}")
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        data = graph.graph_json(results, **{**params, "layout": "precomputed"})
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"map: {len(data['nodes'])} nodes, {len(data['edges'])} edges -> {args.json}")
+
+
+def cmd_quiz(args) -> None:
+    results = _results(args.query, args.top_k, args.mode)
+    ctx = build_context(results, args.query, token_budget=args.token_budget)
+    summary = args.summary or args.query or "ノート全体"
+    data = generate_sharded(summary, ctx["snippets"], quiz_n=args.n, sources=ctx["sources"])
+    out = {"query": args.query, "gaps": data.get("gaps", []), "quiz": data.get("quiz", []),
+           "sources": ctx["sources"], "usage": data.get("_usage", {})}
+    text = json.dumps(out, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"quiz: {len(out['quiz'])} questions -> {args.out}")
+    else:
+        print(text)
+
+
+def _result_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--top-k", type=int, default=15)
+    p.add_argument("--mode", choices=["hybrid", "vector", "lexical"], default=vector_store.SEARCH_MODE)
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(prog="python -m app.cli", description="Knowledge map batch jobs")
+    ap.add_argument("--persist-dir", default=PERSIST_DIR)
+    ap.add_argument("--progress-every", type=float, default=5.0, help="seconds between progress lines")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="index note files and directories")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--suffix", nargs="+", default=list(NOTE_SUFFIXES))
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="reader/cleaner processes (0 = in-process)")
+    p.add_argument("--batch-chunks", type=int, default=256)
+    p.add_argument("--raw-dir", default=DATA_RAW)
+    p.add_argument("--checkpoint", default=None, help="default: one file per set of paths, removed on success")
+    p.add_argument("--no-checkpoint", action="store_true")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("reindex", help="re-embed every row with the configured model (resumable)")
+    p.add_argument("--batch-size", type=int, default=vector_store.UPSERT_BATCH_SIZE)
+    p.add_argument("--checkpoint", default=None, help="default: reindex.json in the persist dir")
+    p.set_defaults(func=cmd_reindex)
+
+    p = sub.add_parser("rebuild-index", help="rebuild side indexes (kNN graph, keyword, overview) from the stored rows")
+    p.add_argument("index", choices=["all", "knn", "lexical", "overview"])
+    p.set_defaults(func=cmd_rebuild_index)
+
+    p = sub.add_parser("search", help="search notes")
+    p.add_argument("query")
+    _result_args(p)
+    p.add_argument("--json", action="store_true")
+    p.add_argument("--snippet-chars", type=int, default=120)
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("map", help="export a map as HTML and/or JSON")
+    p.add_argument("query", nargs="?", default="")
+    _result_args(p)
+    p.add_argument("--all", action="store_true", help="map every stored row (uses the kNN index)")
+    p.add_argument("--max-nodes", type=int, default=5000)
+    p.add_argument("--out", default=None, help="HTML file")
+    p.add_argument("--json", default=None, help="JSON file with nodes/edges")
+    p.add_argument("--assets", choices=["inline", "cdn"], default="inline", help="inline: the HTML also opens offline")
+    p.add_argument("--sim-threshold", type=float, default=0.75)
+    p.add_argument("--knn", type=int, default=5)
+    p.add_argument("--use-index", action="store_true")
+    p.add_argument("--layout", choices=["auto", "physics", "precomputed"], default="auto")
+    p.set_defaults(func=cmd_map)
+
+    p = sub.add_parser("quiz", help="generate gaps and a quiz")
+    p.add_argument("query", nargs="?", default="")
+    _result_args(p)
+    p.add_argument("--n", type=int, default=5, help="number of questions")
+    p.add_argument("--summary", default="")
+    p.add_argument("--token-budget", type=int, default=2500)
+    p.add_argument("--out", default=None)
+    p.set_defaults(func=cmd_quiz)
+
+    args = ap.parse_args(argv)
+    if args.command == "map" and not (args.out or args.json):
+        ap.error("map needs --out and/or --json")
+    vector_store.init_store(args.persist_dir, check_space=args.command != "reindex")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Split documents into token-bounded, overlapping chunks for embedding."""
+from typing import Dict, Iterable, Iterator, List
+import os
+import numpy as np
+from . import tokens
+
+# ~800–1200 tokens per chunk is the recommended size for notes (see AGENT_INSTRUCTIONS.md)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "800"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+
+
+def chunk_id(parent_id: str, index: int) -> str:
+    return f"{parent_id}#c{index}"
+
+
+def iter_chunks(text: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> Iterator[Dict]:
+    """Yield {index, text, start, end} windows of at most `max_tokens` tokens.
+
+    Consecutive windows share `overlap` tokens; `start`/`end` are character offsets
+    into `text`, and chunk text is always a slice of the original string.
+    """
+    if not text:
+        return
+    max_tokens = max(1, int(max_tokens))
+    overlap = max(0, min(int(overlap), max_tokens - 1))
+    step = max_tokens - overlap
+    enc = tokens.encoder()
+    if enc is None:
+        # Fallback without a tokenizer: windows over estimated token positions (see tokens.estimate)
+        cum = tokens.estimate_offsets(text)
+        total = float(cum[-1])
+        index = 0
+        for t0 in np.arange(0.0, total, step):
+            start = int(np.searchsorted(cum, t0, side="right")) if t0 else 0
+            end = int(np.searchsorted(cum, t0 + max_tokens, side="right"))
+            end = len(text) if t0 + max_tokens >= total else max(end, start + 1)
+            yield {"index": index, "text": text[start:end], "start": start, "end": end}
+            index += 1
+            if end >= len(text):
+                break
+        return
+    toks = enc.encode_ordinary(text)
+    _, offsets = enc.decode_with_offsets(toks)
+    n = len(toks)
+    index = 0
+    for t0 in range(0, n, step):
+        t1 = min(n, t0 + max_tokens)
+        start = offsets[t0]
+        end = offsets[t1] if t1 < n else len(text)
+        if end > start:
+            yield {"index": index, "text": text[start:end], "start": start, "end": end}
+            index += 1
+        if t1 >= n:
+            break
+
+
+def chunk_items(items: Iterable[Dict], max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> Iterator[Dict]:
+    """Expand {id, text, meta} documents into chunk items ready for `upsert_texts`."""
+    for item in items:
+        windows = iter_chunks(item.get("text", "") or "", max_tokens=max_tokens, overlap=overlap)
+        yield from items_from_windows(item["id"], item.get("meta", {}) or {}, windows)
+
+
+def items_from_windows(parent_id: str, meta: Dict, windows: Iterable[Dict]) -> Iterator[Dict]:
+    """Chunk items for windows from `iter_chunks` (e.g. computed earlier in a worker process)."""
+    for ch in windows:
+        yield {
+            "id": chunk_id(parent_id, ch["index"]),
+            "text": ch["text"],
+            "meta": {
+                **meta,
+                "parent_id": parent_id,
+                "chunk_index": ch["index"],
+                "char_start": ch["start"],
+                "char_end": ch["end"],
+            },
+        }
+
+
+def parent_of(item_id: str, meta: Dict) -> str:
+    """Parent document id of a stored row (rows stored before chunking are their own parent)."""
+    return (meta or {}).get("parent_id") or item_id
+
+
+def pool_chunks(rows: List[Dict], top_k: int, pooling: str = "max") -> List[Dict]:
+    """Group chunk hits by parent document and rank parents by their chunks.
+
+    `rows` are {id, text, score, meta} with `score` as a Chroma distance (lower is closer).
+    "max" ranks by the best chunk; "sum" adds up chunk similarities so documents
+    with several matching chunks rise. Each parent is represented by its best chunk.
+    """
+    groups: Dict[str, Dict] = {}
+    for r in rows:
+        pid = parent_of(r["id"], r.get("meta", {}))
+        d = r.get("score")
+        # Embeddings are unit length, so squared L2 distance d = 2 - 2cos
+        sim = 1.0 - d / 2.0 if d is not None else 0.0
+        g = groups.get(pid)
+        if g is None:
+            groups[pid] = {"best": r, "best_sim": sim, "sum_sim": sim, "hits": 1}
+            continue
+        g["hits"] += 1
+        g["sum_sim"] += sim
+        if sim > g["best_sim"]:
+            g["best"], g["best_sim"] = r, sim
+    key = (lambda g: g["sum_sim"]) if pooling == "sum" else (lambda g: g["best_sim"])
+    ranked = sorted(groups.items(), key=lambda kv: key(kv[1]), reverse=True)[: max(0, int(top_k))]
+    out: List[Dict] = []
+    for pid, g in ranked:
+        out.append({**g["best"], "parent_id": pid, "hits": g["hits"]})
+    return out
@@ -0,0 +1,29 @@
+"""Process-wide shared API clients (one per process, reused by every Streamlit session)."""
+from functools import lru_cache
+from openai import OpenAI
+import httpx
+import os
+
+# Keep-alive pool shared by all embedding/chat threads of the process
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "16"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    # OPENAI_BASE_URL points the app at a compatible server (e.g. bench/openai_stub.py)
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        ),
+        timeout=OPENAI_TIMEOUT,
+    )
+    # SDK retries are off: retries go through tenacity so they pass the scheduler (see scheduler.py)
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL") or None,
+        http_client=http_client,
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT,
+    )
@@ -0,0 +1,85 @@
+"""Community detection for map colouring: pluggable algorithms, result cache and stable colours."""
+from typing import Dict, List, Sequence, Tuple
+from collections import Counter, OrderedDict
+import hashlib
+import os
+import threading
+import networkx as nx
+
+# louvain | label_propagation | greedy (greedy modularity, slow on large dense graphs)
+COMMUNITY_METHOD = os.getenv("COMMUNITY_METHOD", "louvain")
+COMMUNITY_SEED = 42
+COMMUNITY_CACHE_SIZE = 64
+
+PALETTE = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+]
+
+_cache: "OrderedDict[str, List[List[str]]]" = OrderedDict()
+# Last colour index per node, so communities keep their colour across reruns
+_color_of: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def graph_signature(nodes: Sequence[str], edges: Sequence[Tuple[str, str, float]], method: str) -> str:
+    h = hashlib.sha1(method.encode("utf-8"))
+    for n in sorted(nodes):
+        h.update(n.encode("utf-8", errors="ignore") + b"\0")
+    h.update(b"\1")
+    for a, b, w in sorted((min(a, b), max(a, b), round(float(w), 4)) for a, b, w in edges):
+        h.update(f"{a}\0{b}\0{w}\0".encode("utf-8", errors="ignore"))
+    return h.hexdigest()
+
+
+def _run(G: nx.Graph, method: str) -> List[set]:
+    if G.number_of_edges() == 0:
+        return [{n} for n in G.nodes]
+    if method == "label_propagation":
+        return list(nx.algorithms.community.asyn_lpa_communities(G, weight="weight", seed=COMMUNITY_SEED))
+    if method == "greedy":
+        return list(nx.algorithms.community.greedy_modularity_communities(G, weight="weight"))
+    return list(nx.algorithms.community.louvain_communities(G, weight="weight", seed=COMMUNITY_SEED))
+
+
+def detect(nodes: Sequence[str], edges: Sequence[Tuple[str, str, float]], method: str = COMMUNITY_METHOD) -> List[List[str]]:
+    """Return communities (largest first) for a weighted graph; results are cached by graph signature."""
+    key = graph_signature(nodes, edges, method)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    G = nx.Graph()
+    G.add_nodes_from(nodes)
+    G.add_weighted_edges_from(edges)
+    try:
+        comms = _run(G, method)
+    except Exception:
+        comms = [set(c) for c in nx.connected_components(G)]
+    out = sorted((sorted(c) for c in comms), key=lambda c: (-len(c), c[0]))
+    with _lock:
+        _cache[key] = out
+        while len(_cache) > COMMUNITY_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return out
+
+
+def assign_colors(communities: List[List[str]]) -> Dict[str, str]:
+    """Map node -> colour, reusing each community's previous colour by majority of its members."""
+    used = set()
+    node_idx: Dict[str, int] = {}
+    with _lock:
+        for comm in communities:
+            votes = Counter(_color_of[n] for n in comm if n in _color_of)
+            idx = next((c for c, _ in votes.most_common() if c not in used), None)
+            if idx is None:
+                idx = 0
+                while idx in used:
+                    idx += 1
+            used.add(idx)
+            for n in comm:
+                node_idx[n] = idx
+        if len(_color_of) > 100_000:
+            _color_of.clear()
+        _color_of.update(node_idx)
+    return {n: PALETTE[i % len(PALETTE)] for n, i in node_idx.items()}
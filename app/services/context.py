@@ -0,0 +1,123 @@
+"""Context selection for LLM prompts: MMR over stored chunk embeddings within a token budget.
+
+Candidates are the chunks of the given search results most relevant to the query (at most
+CONTEXT_MAX_CANDIDATES). Chunks are picked greedily by maximal marginal relevance (relevance
+to the query vs. similarity to chunks already picked), so near-identical passages are not
+sent twice, until the token budget is full.
+"""
+from typing import Dict, Iterator, List
+import os
+import numpy as np
+from .embeddings import get_embedding
+from .vector_store import get_chunks
+from .chunking import parent_of
+from .insights import SEPARATOR
+from . import overview as overview_index
+from . import metrics, tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# A chunk is cut to fit the remaining budget only if at least this many tokens remain
+CONTEXT_MIN_TOKENS = int(os.getenv("CONTEXT_MIN_TOKENS", "120"))
+CONTEXT_MAX_CANDIDATES = int(os.getenv("CONTEXT_MAX_CANDIDATES", "400"))
+
+
+def _query_vector(query: str, X: np.ndarray) -> np.ndarray:
+    """Embedding of `query`, or the candidates' mean direction when there is none or it fails."""
+    q = None
+    if query and query.strip():
+        try:
+            q = np.asarray(get_embedding(query), dtype=np.float32)
+        except Exception:
+            q = None
+    if q is None or q.shape[0] != X.shape[1]:
+        q = X.mean(axis=0)
+    n = float(np.linalg.norm(q))
+    return q / n if n > 0 else q
+
+
+def mmr_order(X: np.ndarray, q: np.ndarray, lambda_: float = MMR_LAMBDA) -> Iterator[int]:
+    """Row indices of normalised X in maximal-marginal-relevance order.
+
+    A generator: each pick costs one X @ x pass, so a caller that stops early (budget full)
+    never pays for ranking the rest.
+    """
+    n = X.shape[0]
+    if n == 0:
+        return
+    rel = X @ q
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    chosen = np.zeros(n, dtype=bool)
+    for _ in range(n):
+        score = lambda_ * rel - (1.0 - lambda_) * np.where(np.isfinite(redundancy), redundancy, 0.0)
+        score[chosen] = -np.inf
+        i = int(np.argmax(score))
+        yield i
+        chosen[i] = True
+        redundancy = np.maximum(redundancy, X @ X[i])
+
+
+@metrics.traced("context.build")
+def build_context(
+    results: List[Dict],
+    query: str = "",
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    lambda_: float = MMR_LAMBDA,
+) -> Dict:
+    """Pick snippets for the prompt from the chunks of `results`.
+
+    Returns {"snippets": [...], "sources": [{n, id, parent_id, title, source, tokens, relevance, cluster}],
+    "tokens": total}. Each snippet starts with "[n] title" so answers can cite sources;
+    `cluster` is the chunk's overview cluster (-1 if unknown), used to shard generation.
+    """
+    parents = list(dict.fromkeys(r.get("parent_id") or parent_of(r["id"], r.get("meta", {})) for r in results))
+    rows, X = get_chunks(parents)
+    if not rows:
+        # Nothing stored for these results: fall back to the result texts in rank order
+        rows = [{"id": r["id"], "text": r.get("text", "") or "", "meta": r.get("meta", {}) or {}} for r in results]
+        X = np.eye(len(rows), dtype=np.float32)
+    if not rows:
+        return {"snippets": [], "sources": [], "tokens": 0}
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    X = X / np.where(norms > 0, norms, 1.0)
+    q = _query_vector(query, X)
+    rel = X @ q
+    if len(rows) > CONTEXT_MAX_CANDIDATES:
+        # Keep the most relevant chunks (not the first ones stored) as MMR candidates
+        keep = np.sort(np.argpartition(-rel, CONTEXT_MAX_CANDIDATES - 1)[:CONTEXT_MAX_CANDIDATES])
+        rows, X, rel = [rows[i] for i in keep], X[keep], rel[keep]
+
+    snippets: List[str] = []
+    sources: List[Dict] = []
+    used = 0
+    budget = max(0, int(token_budget))
+    # Snippets are joined with SEPARATOR in the prompt; its tokens count against the budget too
+    sep_tokens = tokens.count(SEPARATOR)
+    for i in mmr_order(X, q, lambda_):
+        sep = sep_tokens if snippets else 0
+        remaining = budget - used - sep
+        if remaining <= 0:
+            break
+        r = rows[i]
+        meta = r["meta"]
+        title = meta.get("title") or parent_of(r["id"], meta)
+        text = f"[{len(snippets) + 1}] {title}\n{r['text'] or ''}"
+        text_cut, n = tokens.truncate(text, remaining)
+        if text_cut != text and remaining < CONTEXT_MIN_TOKENS:
+            continue
+        snippets.append(text_cut)
+        used += sep + n
+        sources.append({
+            "n": len(snippets),
+            "id": r["id"],
+            "parent_id": parent_of(r["id"], meta),
+            "title": title,
+            "source": meta.get("source", ""),
+            "tokens": n,
+            "relevance": float(rel[i]),
+        })
+    clusters = overview_index.cluster_of([src["id"] for src in sources])
+    for src in sources:
+        src["cluster"] = clusters.get(src["id"], -1)
+    metrics.annotate(candidates=len(rows), snippets=len(snippets), tokens=used)
+    return {"snippets": snippets, "sources": sources, "tokens": used}
@@ -0,0 +1,216 @@
+"""Exact and near-duplicate detection for ingest.
+
+Exact duplicates are found by a hash of the normalised text. Near duplicates (edited
+copies of the same notes) are found by 64-bit SimHash over character 3-grams; signatures
+are split into four 16-bit bands, so any pair within 3 bits shares at least one band and
+only those candidates are compared. The index lives next to the Chroma collection.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+
+# "link": store near duplicates with meta.version_of, "skip": drop them, "off": exact dedup only
+DEDUP_NEAR_MODE = os.getenv("DEDUP_NEAR_MODE", "link")
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3"))
+SHINGLE = 3
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip().lower()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(_normalize(text).encode("utf-8", errors="ignore")).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of character 3-grams (works for Japanese without a tokenizer)."""
+    s = _normalize(text).replace(" ", "")
+    if not s:
+        return 0
+    counts: Dict[str, int] = {}
+    for i in range(max(1, len(s) - SHINGLE + 1)):
+        g = s[i : i + SHINGLE]
+        counts[g] = counts.get(g, 0) + 1
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in counts],
+        dtype=np.uint64,
+    )
+    weights = np.array(list(counts.values()), dtype=np.int64)
+    bits = ((hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)).astype(np.int64)
+    acc = (weights[:, None] * (2 * bits - 1)).sum(axis=0)
+    return sum(1 << bit for bit in range(64) if acc[bit] > 0)
+
+
+def _bands(sig: int) -> List[int]:
+    return [(sig >> (16 * b)) & 0xFFFF for b in range(4)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def open_index(persist_dir: str) -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        os.makedirs(persist_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(persist_dir, "dedup.sqlite3"), check_same_thread=False)
+        # SimHash is stored as hex text: SQLite integers are signed 64-bit
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL,"
+            " simhash TEXT NOT NULL, b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS docs_hash ON docs(content_hash)")
+        for b in range(4):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS docs_b{b} ON docs(b{b})")
+        conn.commit()
+        _conn = conn
+
+
+def find_exact(h: str) -> Optional[str]:
+    """Id of a stored document with the same content hash, if any."""
+    if _conn is None:
+        return None
+    with _lock:
+        row = _conn.execute("SELECT doc_id FROM docs WHERE content_hash=? LIMIT 1", (h,)).fetchone()
+    return row[0] if row else None
+
+
+def find_near(sig: int, max_distance: int = NEAR_DUP_MAX_DISTANCE) -> Optional[Tuple[str, int]]:
+    """Closest stored document within `max_distance` bits, as (doc_id, distance)."""
+    if _conn is None or sig == 0:
+        return None
+    b = _bands(sig)
+    with _lock:
+        rows = _conn.execute(
+            "SELECT doc_id, simhash FROM docs WHERE b0=? OR b1=? OR b2=? OR b3=?", b
+        ).fetchall()
+    best = None
+    for doc_id, hexsig in rows:
+        d = hamming(sig, int(hexsig, 16))
+        if d <= max_distance and (best is None or d < best[1]):
+            best = (doc_id, d)
+    return best
+
+
+class RunIndex:
+    """In-memory banded SimHash lookup for the documents of one ingest run (not stored yet)."""
+
+    def __init__(self):
+        self._bands: List[Dict[int, List[str]]] = [{} for _ in range(4)]
+        self._sigs: Dict[str, int] = {}
+
+    def add(self, doc_id: str, sig: int) -> None:
+        if sig == 0:
+            return
+        self._sigs[doc_id] = sig
+        for table, band in zip(self._bands, _bands(sig)):
+            table.setdefault(band, []).append(doc_id)
+
+    def find_near(self, sig: int, max_distance: int = NEAR_DUP_MAX_DISTANCE) -> Optional[Tuple[str, int]]:
+        """Same as the module-level `find_near`, over this run's documents."""
+        if sig == 0:
+            return None
+        best = None
+        seen = set()
+        for table, band in zip(self._bands, _bands(sig)):
+            for other in table.get(band, ()):
+                if other in seen:
+                    continue
+                seen.add(other)
+                d = hamming(sig, self._sigs[other])
+                if d <= max_distance and (best is None or d < best[1]):
+                    best = (other, d)
+        return best
+
+
+def stored(doc_ids: List[str]) -> Set[str]:
+    """The subset of `doc_ids` that is registered (i.e. committed and not deleted since)."""
+    if _conn is None or not doc_ids:
+        return set()
+    ids = list(set(doc_ids))
+    found: Set[str] = set()
+    with _lock:
+        for start in range(0, len(ids), 500):
+            part = ids[start : start + 500]
+            rows = _conn.execute(f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(part))})", part)
+            found.update(r[0] for r in rows)
+    return found
+
+
+def add(docs: List[Tuple[str, str, int]]) -> None:
+    """Register committed documents as (doc_id, content_hash, simhash)."""
+    if _conn is None or not docs:
+        return
+    with _lock:
+        _conn.executemany(
+            "INSERT OR REPLACE INTO docs (doc_id, content_hash, simhash, b0, b1, b2, b3) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(d, h, f"{sig:016x}", *_bands(sig)) for d, h, sig in docs],
+        )
+        _conn.commit()
+
+
+def remove(doc_ids: List[str]) -> None:
+    if _conn is None or not doc_ids:
+        return
+    with _lock:
+        _conn.executemany("DELETE FROM docs WHERE doc_id=?", [(d,) for d in set(doc_ids)])
+        _conn.commit()
+
+
+def clear() -> None:
+    if _conn is None:
+        return
+    with _lock:
+        _conn.execute("DELETE FROM docs")
+        _conn.commit()
+
+
+def backup(path: str) -> None:
+    """Copy the index into a standalone SQLite file (used by `snapshot`)."""
+    if _conn is None:
+        return
+    with _lock:
+        dest = sqlite3.connect(path)
+        try:
+            _conn.backup(dest)
+        finally:
+            dest.close()
+
+
+def merge_from(path: str) -> None:
+    """Add the documents of a file written by `backup`, keeping the current ones."""
+    if _conn is None or not os.path.exists(path):
+        return
+    with _lock:
+        _conn.execute("ATTACH DATABASE ? AS snap", (path,))
+        try:
+            _conn.execute(
+                "INSERT OR REPLACE INTO docs (doc_id, content_hash, simhash, b0, b1, b2, b3)"
+                " SELECT doc_id, content_hash, simhash, b0, b1, b2, b3 FROM snap.docs"
+            )
+            _conn.commit()
+        finally:
+            _conn.execute("DETACH DATABASE snap")
+
+
+def restore_from(path: str) -> None:
+    """Replace the index contents with a file written by `backup`."""
+    if _conn is None or not os.path.exists(path):
+        return
+    with _lock:
+        src = sqlite3.connect(path)
+        try:
+            src.backup(_conn)
+        finally:
+            src.close()
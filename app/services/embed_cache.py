@@ -0,0 +1,47 @@
+"""On-disk embedding cache keyed by (model, max tokens, hash of the truncated text)."""
+from typing import Dict, List
+from array import array
+import hashlib
+import os
+from .sqlite_lru import LRUStore
+
+CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "app/data/cache/embeddings.sqlite3")
+CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+
+
+def make_key(model: str, max_tokens: int, text: str) -> str:
+    h = hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+    return f"{model}:{int(max_tokens)}:{h}"
+
+
+def _pack(vec: List[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+_store = LRUStore(CACHE_PATH, "emb", CACHE_MAX_ENTRIES, _pack, _unpack, column="vec", enabled=CACHE_ENABLED)
+
+
+def get_many(keys: List[str]) -> Dict[str, List[float]]:
+    """Return cached vectors for the given keys and bump their LRU timestamp."""
+    return _store.get_many(keys)
+
+
+def put_many(items: Dict[str, List[float]]) -> None:
+    """Store vectors as float32 blobs, evicting least recently used rows over the size bound."""
+    _store.put_many(items)
+
+
+def stats() -> Dict[str, int]:
+    """Return hit/miss/write/eviction counters plus the current entry count."""
+    return _store.stats()
+
+
+def clear() -> None:
+    _store.clear()
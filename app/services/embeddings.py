@@ -1,42 +1,186 @@
-from typing import List
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
-from openai import OpenAI, BadRequestError, APITimeoutError, APIConnectionError, RateLimitError
+from typing import Callable, Dict, List, NamedTuple, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt, retry_if_exception_type
+from openai import APITimeoutError, APIConnectionError, RateLimitError
 import os
-import tiktoken
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from . import embed_cache
+from . import local_embed
+from . import metrics
+from . import scheduler
+from . import tokens
+from .clients import get_openai_client
 
 # Default max token length for embedding requests (text-embedding-3-small supports 8192 tokens)
 EMBED_MAX_TOKENS = int(os.getenv("EMBED_MAX_TOKENS", "8000"))
 
+# Batch limits for multi-input embedding requests (API allows 2048 inputs / 300k tokens per call)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "200000"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+
+
+# "openai" (default) or "local" (offline hashed n-gram vectors, see local_embed)
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai")
+
+
+class Provider(NamedTuple):
+    """An embedding backend: `embed(model, inputs)` returns one vector per input, in order."""
+    name: str
+    model: Callable[[], str]
+    embed: Callable[[str, List[str]], List[List[float]]]
+    # Remote providers get token-bounded batches sent from a thread pool
+    remote: bool
+
+
+def embed_provider() -> Provider:
+    name = os.getenv("EMBED_PROVIDER", EMBED_PROVIDER)
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown EMBED_PROVIDER {name!r} (expected one of {sorted(PROVIDERS)})")
+    return PROVIDERS[name]
+
+
+def embed_model() -> str:
+    """Model name of the configured embedding provider (recorded with stored vectors)."""
+    return embed_provider().model()
+
+
+def _truncate_with_count(text: str, max_tokens: int) -> Tuple[str, int]:
+    """Truncate `text` to `max_tokens` and return it with its (estimated) token count.
+
+    Inputs that obviously fit are not encoded (see `tokens.truncate`); the count is then an estimate.
+    """
+    return tokens.truncate(text or "", max_tokens, exact=False)
+
 
 def _truncate_by_tokens(text: str, max_tokens: int) -> str:
-    if not text:
-        return ""
-    try:
-        enc = tiktoken.get_encoding("cl100k_base")
-    except Exception:
-        # Fallback: naive char cut if tokenizer unavailable
-        return text[: max(0, int(max_tokens * 4))]
-    tokens = enc.encode(text)
-    if len(tokens) <= max_tokens:
-        return text
-    tokens = tokens[:max_tokens]
-    try:
-        return enc.decode(tokens)
-    except Exception:
-        # As a last resort, fallback to char cut roughly
-        return text[: max(0, int(max_tokens * 4))]
-
-
-# Retry only on transient OpenAI errors, not on BadRequest (which is usually input-too-long)
+    return _truncate_with_count(text, max_tokens)[0]
+
+
+def get_embedding(text: str) -> List[float]:
+    with metrics.span("embeddings.query") as sp:
+        model = embed_model()
+        safe, n_tokens = _truncate_with_count(text or "", EMBED_MAX_TOKENS)
+        key = embed_cache.make_key(model, EMBED_MAX_TOKENS, safe)
+        hit = embed_cache.get_many([key])
+        sp.set(tokens=n_tokens, cached=key in hit)
+        if key in hit:
+            return hit[key]
+        provider = embed_provider()
+        # A user is waiting on this one: go ahead of queued ingest batches
+        with scheduler.priority(scheduler.INTERACTIVE):
+            emb = provider.embed(model, [safe])[0]
+        embed_cache.put_many({key: emb})
+        return emb
+
+
+# Retry only on transient OpenAI errors, not on BadRequest (which is usually input-too-long).
+# Each batch retries on its own, so a transient failure only re-sends that batch
 @retry(
-    wait=wait_exponential(min=1, max=10),
+    wait=scheduler.retry_wait,
     stop=stop_after_attempt(3),
     retry=retry_if_exception_type((APITimeoutError, APIConnectionError, RateLimitError)),
+    before_sleep=metrics.retry_hook("openai.embeddings"),
 )
-def get_embedding(text: str) -> List[float]:
-    model = os.getenv("OPENAI_MODEL_EMBED", "text-embedding-3-small")
-    safe = _truncate_by_tokens(text or "", EMBED_MAX_TOKENS)
-    res = client.embeddings.create(model=model, input=safe)
-    return res.data[0].embedding
+def _embed_batch(model: str, inputs: List[str]) -> List[List[float]]:
+    with metrics.span("openai.embeddings", inputs=len(inputs)) as sp:
+        # Inputs are already truncated; an estimate is enough, the reported usage settles it
+        estimate = sum(tokens.count_many(inputs, exact=False))
+        with scheduler.slot("embeddings", estimate) as slot:
+            res = get_openai_client().embeddings.create(model=model, input=inputs)
+            used = getattr(getattr(res, "usage", None), "prompt_tokens", None)
+            slot.settle(used)
+        tokens.record("embeddings", used if used is not None else estimate)
+        # The API tags each vector with its input index; don't rely on response order
+        data = sorted(res.data, key=lambda d: d.index)
+        sp.set(tokens=used)
+        metrics.incr("openai.embeddings.calls")
+        return [d.embedding for d in data]
+
+
+PROVIDERS: Dict[str, Provider] = {
+    "openai": Provider(
+        name="openai",
+        model=lambda: os.getenv("OPENAI_MODEL_EMBED", "text-embedding-3-small"),
+        embed=_embed_batch,
+        remote=True,
+    ),
+    "local": Provider(
+        name="local",
+        model=lambda: local_embed.model_name(),
+        embed=lambda model, inputs: local_embed.embed(inputs),
+        remote=False,
+    ),
+}
+
+
+def _pack_batches(counts: List[int], max_items: int, max_tokens: int) -> List[List[int]]:
+    """Group input indices into consecutive batches bounded by item count and token sum."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_tokens = 0
+    for i, n in enumerate(counts):
+        if cur and (len(cur) >= max_items or cur_tokens + n > max_tokens):
+            batches.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(i)
+        cur_tokens += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def get_embeddings(
+    texts: List[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    batch_tokens: int = EMBED_BATCH_TOKENS,
+    max_workers: int = EMBED_MAX_WORKERS,
+) -> List[List[float]]:
+    """Embed many texts with multi-input requests; output order matches `texts`.
+
+    Cached vectors are served from the embedding cache; only misses hit the provider.
+    """
+    if not texts:
+        return []
+    with metrics.span("embeddings.batch", texts=len(texts)):
+        return _get_embeddings(texts, batch_size, batch_tokens, max_workers)
+
+
+def _get_embeddings(texts: List[str], batch_size: int, batch_tokens: int, max_workers: int) -> List[List[float]]:
+    provider = embed_provider()
+    model = provider.model()
+    prepared = [_truncate_with_count(t or "", EMBED_MAX_TOKENS) for t in texts]
+    keys = [embed_cache.make_key(model, EMBED_MAX_TOKENS, p[0]) for p in prepared]
+    cached = embed_cache.get_many(keys)
+
+    out: List[List[float]] = [cached.get(k) for k in keys]  # type: ignore[misc]
+    # Embed each distinct missing text once, even if it repeats in the input
+    first: Dict[str, int] = {}
+    for i, k in enumerate(keys):
+        if out[i] is None and k not in first:
+            first[k] = i
+    missing = list(first.values())
+    metrics.annotate(cache_hits=len(cached), embedded=len(missing))
+    if not missing:
+        return out
+
+    fresh: Dict[str, List[float]] = {}
+    if not provider.remote:
+        for i, emb in zip(missing, provider.embed(model, [prepared[i][0] for i in missing])):
+            fresh[keys[i]] = emb
+        embed_cache.put_many(fresh)
+        return [o if o is not None else fresh[k] for o, k in zip(out, keys)]
+
+    batches = _pack_batches([prepared[i][1] for i in missing], max(1, int(batch_size)), max(1, int(batch_tokens)))
+    metrics.annotate(requests=len(batches))
+    workers = max(1, min(int(max_workers), len(batches)))
+    embed = metrics.bind(provider.embed)  # worker spans nest under this batch
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for idx in batches:
+            pos = [missing[j] for j in idx]
+            futures.append((pos, pool.submit(embed, model, [prepared[i][0] for i in pos])))
+        for pos, fut in futures:
+            for i, emb in zip(pos, fut.result()):
+                fresh[keys[i]] = emb
+    embed_cache.put_many(fresh)
+    return [o if o is not None else fresh[k] for o, k in zip(out, keys)]
@@ -1,80 +1,349 @@
 from pyvis.network import Network
 import networkx as nx
-from typing import List, Dict, Tuple
-import tempfile
-import math
-from .vector_store import get_embeddings_by_ids
-
-
-def _cosine_sim(u: List[float], v: List[float]) -> float:
-    if not u or not v or len(u) != len(v):
-        return 0.0
-    dot = 0.0
-    nu = 0.0
-    nv = 0.0
-    for a, b in zip(u, v):
-        dot += a * b
-        nu += a * a
-        nv += b * b
-    if nu <= 0 or nv <= 0:
-        return 0.0
-    return dot / (math.sqrt(nu) * math.sqrt(nv))
-
-
-def _pairwise_sims(ids: List[str], embs: Dict[str, List[float]]) -> Dict[Tuple[int, int], float]:
-    sims: Dict[Tuple[int, int], float] = {}
-    n = len(ids)
-    for i in range(n):
-        ei = embs.get(ids[i])
-        if ei is None:
-            continue
-        for j in range(i + 1, n):
-            ej = embs.get(ids[j])
-            if ej is None:
-                continue
-            s = _cosine_sim(ei, ej)
-            sims[(i, j)] = s
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+from .vector_store import get_embedding_matrix, get_generation
+from . import knn_index
+from . import communities
+from . import layout as node_layout
+from . import metrics
+from . import tokens
+
+# Above this many nodes, top-k neighbours are found in row blocks instead of the full n×n matrix
+GRAPH_EXACT_MAX_N = int(os.getenv("GRAPH_EXACT_MAX_N", "2000"))
+# Scores held at once by the blocked top-k (rows per block = this // n)
+GRAPH_BLOCK_SCORES = int(os.getenv("GRAPH_BLOCK_SCORES", str(1 << 24)))
+# Length of the text preview in node tooltips
+GRAPH_TOOLTIP_TOKENS = int(os.getenv("GRAPH_TOOLTIP_TOKENS", "80"))
+
+
+def _aligned_matrix(ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Embeddings of `ids` read from the store as one L2-normalised float32 matrix.
+
+    Returns (X, valid): rows without a stored embedding are zero and `valid[i]` is False.
+    Zero-norm vectors stay zero rows, i.e. similarity 0 to everything.
+    """
+    X, index = get_embedding_matrix(ids)
+    out = np.zeros((len(ids), X.shape[1]), dtype=np.float32)
+    valid = np.array([i in index for i in ids], dtype=bool)
+    if valid.any():
+        out[valid] = X[[index[i] for i in ids if i in index]]
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out, valid
+
+
+def _sims_from_matrix(X: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """All-pairs cosine similarity as an n×n float32 matrix from a single matrix product.
+
+    Pairs involving a missing embedding and the diagonal are -inf, so they never pass a threshold.
+    """
+    sims = X @ X.T
+    sims[~valid, :] = -np.inf
+    sims[:, ~valid] = -np.inf
+    np.fill_diagonal(sims, -np.inf)
     return sims
 
 
-def _build_mutual_knn_edges(ids: List[str], sims: Dict[Tuple[int, int], float], k: int, thr: float) -> List[Tuple[str, str, float]]:
+def _blocked_topk(X: np.ndarray, valid: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbours per row of normalised X (self and invalid rows excluded), in row blocks.
+
+    Returns (idx, sims), both n×k sorted by descending similarity; -1 / -inf pad rows with
+    fewer than k valid neighbours. Memory is bounded by GRAPH_BLOCK_SCORES, not n×n.
+    """
+    n = X.shape[0]
+    k = max(0, min(int(k), n - 1))
+    idx = np.full((n, k), -1, dtype=np.int64)
+    sims = np.full((n, k), -np.inf, dtype=np.float32)
+    if k == 0:
+        return idx, sims
+    step = max(1, GRAPH_BLOCK_SCORES // max(1, n))
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        block = X[start:stop] @ X.T
+        block[:, ~valid] = -np.inf
+        block[~valid[start:stop]] = -np.inf
+        rows = np.arange(start, stop)
+        block[rows - start, rows] = -np.inf
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        vals = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-vals, axis=1)
+        top, vals = np.take_along_axis(top, order, axis=1), np.take_along_axis(vals, order, axis=1)
+        idx[start:stop] = np.where(np.isfinite(vals), top, -1)
+        sims[start:stop] = vals
+    return idx, sims
+
+
+def _screened_edges(
+    ids: List[str], X: np.ndarray, valid: np.ndarray, k: int, thr: float, min_visual_sim: float, per_node: int
+) -> Tuple[List[Tuple[str, str, float]], List[Tuple[str, str, float]]]:
+    """Strong (mutual kNN ≥ thr) and weak (≥ min_visual_sim) edges among each node's top neighbours.
+
+    Memory is O(n·candidates) instead of the n×n matrix; weak edges are limited to the
+    candidates, which matches the per-node edge budget applied afterwards.
+    """
+    n = len(ids)
+    k = max(1, min(int(k), n - 1))
+    idx, sims = _blocked_topk(X, valid, max(k, int(per_node) or k))
+    rows = np.repeat(np.arange(n), idx.shape[1])
+    cols, vals = idx.ravel(), sims.ravel()
+    ok = (cols >= 0) & np.isfinite(vals)
+    # Strong: j is among i's top-k above thr and vice versa
+    in_knn = ok & (np.tile(np.arange(idx.shape[1]), n) < k) & (vals >= thr)
+    knn_codes = rows[in_knn] * n + cols[in_knn]
+    mutual = np.isin(knn_codes, cols[in_knn] * n + rows[in_knn])
+    strong: List[Tuple[str, str, float]] = []
+    strong_set = set()
+    for i, j, s in zip(rows[in_knn][mutual], cols[in_knn][mutual], vals[in_knn][mutual]):
+        a, b = (ids[i], ids[j]) if ids[i] < ids[j] else (ids[j], ids[i])
+        if (a, b) not in strong_set:
+            strong_set.add((a, b))
+            strong.append((a, b, float(s)))
+    weak: List[Tuple[str, str, float]] = []
+    weak_sel = ok & (vals >= min_visual_sim)
+    for i, j, s in zip(rows[weak_sel], cols[weak_sel], vals[weak_sel]):
+        a, b = (ids[i], ids[j]) if ids[i] < ids[j] else (ids[j], ids[i])
+        if (a, b) not in strong_set:
+            strong_set.add((a, b))
+            weak.append((a, b, float(s)))
+    return strong, weak
+
+
+def _build_mutual_knn_edges(ids: List[str], sims: np.ndarray, k: int, thr: float) -> List[Tuple[str, str, float]]:
     n = len(ids)
-    # Collect neighbor lists from sims
-    nbrs: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
-    for (i, j), s in sims.items():
-        if s >= thr:
-            nbrs[i].append((j, s))
-            nbrs[j].append((i, s))
-    for i in range(n):
-        nbrs[i].sort(key=lambda x: x[1], reverse=True)
-        if k > 0:
-            del nbrs[i][k:]
+    if n < 2:
+        return []
+    # Neighbor candidates: similarities at or above the threshold
+    cand = np.where(sims >= thr, sims, -np.inf)
+    k = n - 1 if k <= 0 else min(int(k), n - 1)
+    if k < n - 1:
+        top = np.argpartition(-cand, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n), (n, n))
+    knn = np.zeros((n, n), dtype=bool)
+    knn[np.arange(n)[:, None], top] = True
+    knn &= np.isfinite(cand)
     # Keep mutual only
+    mutual = np.triu(knn & knn.T, 1)
     edges: List[Tuple[str, str, float]] = []
-    for i in range(n):
-        picked = {j for j, _ in nbrs[i]}
-        for j, s in nbrs[i]:
-            if i in {ii for ii, _ in nbrs[j]}:
-                a, b = ids[i], ids[j]
-                if a < b:
-                    edges.append((a, b, s))
+    for i, j in zip(*np.nonzero(mutual)):
+        a, b = ids[i], ids[j]
+        if a > b:
+            a, b = b, a
+        edges.append((a, b, float(sims[i, j])))
     return edges
 
 
-def build_graph(
+# Level-of-detail limits: per-node and global edge budgets, cluster collapse above a node count
+GRAPH_MAX_EDGES_PER_NODE = int(os.getenv("GRAPH_MAX_EDGES_PER_NODE", "8"))
+GRAPH_MAX_EDGES = int(os.getenv("GRAPH_MAX_EDGES", "3000"))
+GRAPH_CLUSTER_THRESHOLD = int(os.getenv("GRAPH_CLUSTER_THRESHOLD", "400"))
+
+
+def _sparsify_edges(
+    strong: List[Tuple[str, str, float]],
+    weak: List[Tuple[str, str, float]],
+    per_node: int,
+    cap: int,
+) -> Tuple[List[Tuple[str, str, float]], List[Tuple[str, str, float]]]:
+    """Keep strong edges first, then the strongest weak edges whose endpoints both have budget left."""
+    strong = sorted(strong, key=lambda e: e[2], reverse=True)
+    if cap > 0:
+        strong = strong[:cap]
+    degree: Dict[str, int] = {}
+    for a, b, _ in strong:
+        degree[a] = degree.get(a, 0) + 1
+        degree[b] = degree.get(b, 0) + 1
+    room = (cap - len(strong)) if cap > 0 else len(weak)
+    kept: List[Tuple[str, str, float]] = []
+    for a, b, s in sorted(weak, key=lambda e: e[2], reverse=True):
+        if len(kept) >= room:
+            break
+        if per_node > 0 and (degree.get(a, 0) >= per_node or degree.get(b, 0) >= per_node):
+            continue
+        kept.append((a, b, s))
+        degree[a] = degree.get(a, 0) + 1
+        degree[b] = degree.get(b, 0) + 1
+    return strong, kept
+
+
+def _cluster_graph(G: nx.Graph, comms: List[List[str]]) -> nx.Graph:
+    """Collapse each community into one super-node sized by member count."""
+    C = nx.Graph()
+    owner: Dict[str, int] = {}
+    for ci, comm in enumerate(comms):
+        members = [n for n in comm if n in G.nodes]
+        if not members:
+            continue
+        for n in members:
+            owner[n] = ci
+        labels = [str(G.nodes[n].get("label", n)) for n in members[:5]]
+        more = f"<br>… 他 {len(members) - 5} 件" if len(members) > 5 else ""
+        C.add_node(
+            f"cluster:{ci}",
+            label=f"#{ci} {labels[0]} ({len(members)})",
+            title=f"<b>クラスタ #{ci}</b> ({len(members)} 件)<br>" + "<br>".join(labels) + more,
+            color=G.nodes[members[0]].get("color"),
+            value=len(members),
+        )
+    links: Dict[Tuple[int, int], List[float]] = {}
+    for a, b, d in G.edges(data=True):
+        ca, cb = owner.get(a), owner.get(b)
+        if ca is None or cb is None or ca == cb:
+            continue
+        key = (ca, cb) if ca < cb else (cb, ca)
+        links.setdefault(key, []).append(float(d.get("weight", 0.0)))
+    for (ca, cb), ws in links.items():
+        C.add_edge(
+            f"cluster:{ca}", f"cluster:{cb}",
+            weight=max(ws), value=len(ws), color="rgba(90,90,90,0.6)",
+            title=f"{len(ws)} links / max sim: {max(ws):.2f}",
+        )
+    return C
+
+
+# "cdn": vis-network / tom-select from the CDN (as pyvis emits them); "inline": the vendored copies
+# in lib/ embedded in the page (offline use, standalone files)
+GRAPH_ASSETS = os.getenv("GRAPH_ASSETS", "cdn")
+GRAPH_ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib")
+GRAPH_HTML_CACHE_SIZE = int(os.getenv("GRAPH_HTML_CACHE_SIZE", "32"))
+
+_html_cache: "OrderedDict[str, str]" = OrderedDict()
+_html_lock = threading.Lock()
+
+# pyvis' CDN tag for each asset -> vendored file and the inline tag it becomes
+_ASSET_TAGS = (
+    (r'<link rel="stylesheet" href="https://cdnjs[^"]*/vis-network[^"]*\.css"[^>]*>', "vis-9.1.2/vis-network.css", "style"),
+    (r'<script src="https://cdnjs[^"]*/vis-network[^"]*\.js"[^>]*></script>', "vis-9.1.2/vis-network.min.js", "script"),
+    (r'<link rel="stylesheet" href="https://cdnjs[^"]*/tom-select[^"]*\.css"[^>]*>', "tom-select/tom-select.css", "style"),
+    (r'<script src="https://cdnjs[^"]*/tom-select[^"]*\.js"[^>]*></script>', "tom-select/tom-select.complete.min.js", "script"),
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _inline_tags() -> Tuple[Tuple["re.Pattern", str], ...]:
+    """(CDN tag pattern, inline replacement) pairs; the vendored files are read once per process."""
+    out = []
+    for pattern, path, tag in _ASSET_TAGS:
+        with open(os.path.join(GRAPH_ASSET_DIR, path), "r", encoding="utf-8") as f:
+            out.append((re.compile(pattern), f"<{tag}>{f.read()}</{tag}>"))
+    return tuple(out)
+
+
+def _shared_assets(html: str, assets: str = GRAPH_ASSETS) -> str:
+    """Apply the asset mode to a page rendered with pyvis' CDN resources (utils.js is already inline)."""
+    if assets != "inline":
+        return html
+    for pattern, inline in _inline_tags():
+        # A function replacement: the bundle's backslashes must not be read as escapes
+        html = pattern.sub(lambda _m, s=inline: s, html)
+    return html
+
+
+def _render_key(results: List[Dict], score_key: str, params: Dict) -> str:
+    """Hash of the parameters and of what each node displays (id, score, title, text)."""
+    h = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    for r in results:
+        node = (r["id"], r.get(score_key), (r.get("meta") or {}).get("title"), r.get("text") or "")
+        h.update(json.dumps(node, ensure_ascii=False, default=str).encode("utf-8", errors="ignore") + b"\0")
+    return h.hexdigest()
+
+
+def _net_options(precomputed: bool) -> str:
+    options = {
+        "physics": {
+            "enabled": True,
+            "barnesHut": {
+                "gravitationalConstant": -30000,
+                "centralGravity": 0.2,
+                "springLength": 120,
+                "springConstant": 0.03,
+                "damping": 0.4,
+                "avoidOverlap": 0.6,
+            },
+        },
+        "edges": {
+            "smooth": {"type": "dynamic"},
+            "color": {"inherit": False},
+            "scaling": {"min": 1, "max": 6},
+        },
+        "nodes": {
+            "shape": "dot",
+            "scaling": {"min": 5, "max": 30},
+            "font": {"size": 14},
+        },
+        "layout": {"improvedLayout": True},
+    }
+    if precomputed:
+        # Positions come from the server: no simulation, no dynamic (physics-driven) edge curves
+        options["physics"] = {"enabled": False}
+        options["edges"]["smooth"] = False
+        options["layout"] = {"improvedLayout": False}
+    return json.dumps(options)
+
+
+def _build_nx(
     results: List[Dict],
-    score_key: str = "score",
-    sim_threshold: float = 0.75,
-    knn: int = 5,
-    include_tooltips: bool = True,
-    min_visual_sim: float = 0.40,
-):
-    # Collect node ids and fetch embeddings from the vector store
+    score_key: str,
+    sim_threshold: float,
+    knn: int,
+    include_tooltips: bool,
+    min_visual_sim: float,
+    use_index: bool,
+    community_method: str,
+    layout: str,
+    max_edges_per_node: int,
+    max_edges: int,
+    cluster_threshold: int,
+    focus_cluster: Optional[int],
+) -> Tuple[nx.Graph, bool]:
+    """The map as a networkx graph (nodes/edges carry vis attributes) and whether x/y are set."""
     ids = [r["id"] for r in results]
-    embs = get_embeddings_by_ids(ids)
-
-    # Fallback: if embeddings missing for many nodes, degrade gracefully to distance-difference edges
-    use_pairwise = len(embs) >= max(3, int(0.6 * len(ids)))
+    embs: Dict[str, np.ndarray] = {}
+    strong_edges: List[Tuple[str, str, float]] = []
+    weak_edges: List[Tuple[str, str, float]] = []
+    with metrics.span("graph.knn_index"):
+        indexed = knn_index.edges_among(ids, k=max(1, int(knn))) if use_index and len(ids) >= 2 else []
+    if indexed:
+        use_pairwise = True
+        for a, b, s, mutual in indexed:
+            if mutual and s >= sim_threshold:
+                strong_edges.append((a, b, s))
+            elif s >= min_visual_sim:
+                weak_edges.append((a, b, s))
+    else:
+        # Fetch embeddings from the vector store as one float32 matrix aligned with ids
+        X, valid = _aligned_matrix(ids)
+        embs = {nid: X[i] for i, nid in enumerate(ids) if valid[i]}
+        # Fallback: if embeddings missing for many nodes, degrade gracefully to distance-difference edges
+        use_pairwise = len(embs) >= max(3, int(0.6 * len(ids)))
+        if use_pairwise and len(ids) > GRAPH_EXACT_MAX_N:
+            with metrics.span("graph.similarity", method="blocked"):
+                strong_edges, weak_edges = _screened_edges(
+                    ids, X, valid, int(knn), float(sim_threshold), float(min_visual_sim), int(max_edges_per_node)
+                )
+        elif use_pairwise and len(ids) >= 2:
+            # Compute all pairwise similarities once
+            with metrics.span("graph.similarity", method="exact"):
+                sims = _sims_from_matrix(X, valid)
+            # Strong edges: mutual kNN above threshold
+            strong_edges = _build_mutual_knn_edges(ids, sims, k=max(1, int(knn)), thr=float(sim_threshold))
+            strong_set = {(a, b) if a < b else (b, a) for a, b, _ in strong_edges}
+            # Weak edges: faint links above min_visual_sim (not necessarily mutual), avoid duplicates
+            weak = np.triu(sims >= min_visual_sim, 1)
+            for i, j in zip(*np.nonzero(weak)):
+                a, b = ids[i], ids[j]
+                key = (a, b) if a < b else (b, a)
+                if key not in strong_set:
+                    weak_edges.append((a, b, float(sims[i, j])))
+    strong_edges, weak_edges = _sparsify_edges(strong_edges, weak_edges, int(max_edges_per_node), int(max_edges))
 
     G = nx.Graph()
     for r in results:
@@ -82,7 +351,7 @@ def build_graph(
         title = r.get("meta", {}).get("title", nid)
         tooltip = None
         if include_tooltips:
-            snippet = (r.get("text", "") or "")[:160].replace("\n", " ")
+            snippet = tokens.truncate(r.get("text", "") or "", GRAPH_TOOLTIP_TOKENS, exact=False)[0].replace("\n", " ")
             tooltip = f"<b>{title}</b><br>{snippet}"
         if tooltip:
             G.add_node(nid, label=title, title=tooltip)
@@ -90,23 +359,11 @@ def build_graph(
             G.add_node(nid, label=title)
 
     if use_pairwise and len(ids) >= 2:
-        # Compute all pairwise similarities once
-        sims = _pairwise_sims(ids, embs)
-        # Strong edges: mutual kNN above threshold
-        strong_edges = _build_mutual_knn_edges(ids, sims, k=max(1, int(knn)), thr=float(sim_threshold))
-        strong_set = {(a, b) if a < b else (b, a) for a, b, _ in strong_edges}
         for a, b, s in strong_edges:
             # width/value scaled by similarity among strong range
             value = 3 + 5 * max(0.0, (s - sim_threshold) / max(1e-6, 1.0 - sim_threshold))
             G.add_edge(a, b, weight=s, value=value, color="rgba(60,60,60,0.85)", title=f"sim: {s:.2f}")
-        # Weak edges: show faint links above min_visual_sim (not necessarily mutual), avoid duplicates
-        for (i, j), s in sims.items():
-            if s < min_visual_sim:
-                continue
-            a, b = ids[i], ids[j]
-            key = (a, b) if a < b else (b, a)
-            if key in strong_set:
-                continue
+        for a, b, s in weak_edges:
             # Thin, dashed, transparent
             t = (s - min_visual_sim) / max(1e-6, (sim_threshold - min_visual_sim))
             t = max(0.0, min(1.0, t))
@@ -125,59 +382,140 @@ def build_graph(
                     value = 1 + 4 * (s - 0.7) / 0.3
                     G.add_edge(a["id"], b["id"], weight=s, value=value, color="rgba(120,120,120,0.5)", title=f"sim*: {s:.2f}")
 
-    # Color by communities (greedy modularity); fallback to connected components
-    colors = [
-        "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
-        "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
-    ]
-    try:
-        comms = list(nx.algorithms.community.greedy_modularity_communities(G))
-    except Exception:
-        comms = [set(c) for c in nx.connected_components(G)]
-    for ci, comm in enumerate(comms):
-        color = colors[ci % len(colors)]
-        for n in comm:
-            if n in G.nodes:
-                G.nodes[n]["color"] = color
-
-    # Node size by degree
-    for n in G.nodes:
-        deg = G.degree[n]
-        G.nodes[n]["value"] = max(5, 10 + 2 * deg)
-
-    net = Network(height="600px", width="100%", directed=False, notebook=False)
-    net.from_nx(G)
-
-    # Physics/layout tuning
-    net.set_options(
-        """
-        {
-          "physics": {
-            "enabled": true,
-            "barnesHut": {
-              "gravitationalConstant": -30000,
-              "centralGravity": 0.2,
-              "springLength": 120,
-              "springConstant": 0.03,
-              "damping": 0.4,
-              "avoidOverlap": 0.6
-            }
-          },
-          "edges": {
-            "smooth": { "type": "dynamic" },
-            "color": { "inherit": false },
-            "scaling": { "min": 1, "max": 6 }
-          },
-          "nodes": {
-            "shape": "dot",
-            "scaling": { "min": 5, "max": 30 },
-            "font": { "size": 14 }
-          },
-          "layout": { "improvedLayout": true }
-        }
-        """
+    # Color by communities detected on strong edges (all edges if there are none)
+    comm_edges = strong_edges or [(a, b, d.get("weight", 0.0)) for a, b, d in G.edges(data=True)]
+    with metrics.span("graph.communities", edges=len(comm_edges)):
+        comms = communities.detect(list(G.nodes), comm_edges, method=community_method)
+    for n, color in communities.assign_colors(comms).items():
+        if n in G.nodes:
+            G.nodes[n]["color"] = color
+
+    collapsed = False
+    if focus_cluster is not None and 0 <= int(focus_cluster) < len(comms):
+        members = set(comms[int(focus_cluster)])
+        G = G.subgraph([n for n in G.nodes if n in members]).copy()
+        strong_edges = [e for e in strong_edges if e[0] in members and e[1] in members]
+        weak_edges = [e for e in weak_edges if e[0] in members and e[1] in members]
+    elif cluster_threshold > 0 and G.number_of_nodes() > cluster_threshold:
+        G = _cluster_graph(G, comms)
+        collapsed = True
+
+    # Node size by degree (super-nodes are already sized by member count)
+    if not collapsed:
+        for n in G.nodes:
+            deg = G.degree[n]
+            G.nodes[n]["value"] = max(5, 10 + 2 * deg)
+
+    precomputed = not collapsed and (
+        layout == "precomputed" or (layout == "auto" and G.number_of_nodes() > node_layout.LAYOUT_NODE_THRESHOLD)
     )
+    if precomputed:
+        need = [n for n in node_layout.missing(list(G.nodes)) if n not in embs]
+        if need:
+            X, index = get_embedding_matrix(need)
+            embs = {**embs, **{nid: X[row] for nid, row in index.items()}}
+        with metrics.span("graph.layout", nodes=G.number_of_nodes()):
+            pos = node_layout.compute_layout(list(G.nodes), strong_edges + weak_edges, embs)
+        for n, (x, y) in pos.items():
+            G.nodes[n]["x"] = x
+            G.nodes[n]["y"] = y
+    return G, precomputed
+
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-    net.write_html(tmp.name, open_browser=False, notebook=False)
-    return tmp.name
+@metrics.traced("build_graph", is_request=True)
+def build_graph(
+    results: List[Dict],
+    score_key: str = "score",
+    sim_threshold: float = 0.75,
+    knn: int = 5,
+    include_tooltips: bool = True,
+    min_visual_sim: float = 0.40,
+    use_index: bool = False,
+    community_method: str = communities.COMMUNITY_METHOD,
+    layout: str = "auto",
+    max_edges_per_node: int = GRAPH_MAX_EDGES_PER_NODE,
+    max_edges: int = GRAPH_MAX_EDGES,
+    cluster_threshold: int = GRAPH_CLUSTER_THRESHOLD,
+    focus_cluster: Optional[int] = None,
+    assets: str = GRAPH_ASSETS,
+):
+    """Render results as a pyvis map and return the HTML document as a string.
+
+    With `use_index=True` edges come from the stored corpus kNN graph (see `knn_index`)
+    instead of recomputing pairwise similarities, so large node sets (e.g. the whole
+    corpus) cost O(edges). Mutual-ness is then judged on corpus-level neighbour ranks.
+
+    `layout` is "physics" (browser-side simulation), "precomputed" (fixed x/y from
+    `layout.compute_layout`, physics off) or "auto" (precomputed above LAYOUT_NODE_THRESHOLD nodes).
+
+    Level of detail: edges are capped per node and globally (0 disables a limit). Above
+    `cluster_threshold` nodes each community is drawn as one super-node ("#i" in its label);
+    pass `focus_cluster=i` to render only that community's members.
+
+    `assets` is "cdn" or "inline" (vendored vis-network embedded, e.g. for standalone files).
+    Rendered pages are cached in memory by (displayed node data, parameters, store generation).
+    """
+    ids = [r["id"] for r in results]
+    cache_key = _render_key(results, score_key, {
+        "score_key": score_key, "sim_threshold": sim_threshold, "knn": knn,
+        "include_tooltips": include_tooltips, "min_visual_sim": min_visual_sim,
+        "use_index": use_index, "community_method": community_method, "layout": layout,
+        "max_edges_per_node": max_edges_per_node, "max_edges": max_edges,
+        "cluster_threshold": cluster_threshold, "focus_cluster": focus_cluster,
+        "generation": get_generation(), "assets": assets,
+    })
+    metrics.annotate(nodes=len(ids), use_index=bool(use_index))
+    with _html_lock:
+        if cache_key in _html_cache:
+            _html_cache.move_to_end(cache_key)
+            metrics.annotate(cached=True, html_bytes=len(_html_cache[cache_key]))
+            return _html_cache[cache_key]
+    G, precomputed = _build_nx(
+        results, score_key, sim_threshold, knn, include_tooltips, min_visual_sim, use_index,
+        community_method, layout, max_edges_per_node, max_edges, cluster_threshold, focus_cluster,
+    )
+    with metrics.span("graph.render", nodes=G.number_of_nodes(), edges=G.number_of_edges()):
+        net = Network(height="600px", width="100%", directed=False, notebook=False, cdn_resources="remote")
+        net.from_nx(G)
+
+        # Physics/layout tuning
+        net.set_options(_net_options(precomputed))
+
+        html = _shared_assets(net.generate_html(notebook=False), assets)
+    metrics.annotate(cached=False, edges=G.number_of_edges(), html_bytes=len(html))
+    with _html_lock:
+        _html_cache[cache_key] = html
+        while len(_html_cache) > GRAPH_HTML_CACHE_SIZE:
+            _html_cache.popitem(last=False)
+    return html
+
+
+def graph_json(
+    results: List[Dict],
+    score_key: str = "score",
+    sim_threshold: float = 0.75,
+    knn: int = 5,
+    min_visual_sim: float = 0.40,
+    use_index: bool = False,
+    community_method: str = communities.COMMUNITY_METHOD,
+    layout: str = "precomputed",
+    max_edges_per_node: int = GRAPH_MAX_EDGES_PER_NODE,
+    max_edges: int = GRAPH_MAX_EDGES,
+    cluster_threshold: int = 0,
+    focus_cluster: Optional[int] = None,
+) -> Dict:
+    """The same map as `build_graph` as plain data: {"nodes": [...], "edges": [...]}.
+
+    Nodes carry id, label, color, value and x/y (with a precomputed layout); edges carry
+    source, target, weight and whether they are weak (dashed). Nothing is collapsed by default.
+    """
+    G, _ = _build_nx(
+        results, score_key, sim_threshold, knn, False, min_visual_sim, use_index,
+        community_method, layout, max_edges_per_node, max_edges, cluster_threshold, focus_cluster,
+    )
+    nodes = [{"id": n, **{k: float(v) if isinstance(v, np.floating) else v for k, v in d.items()}} for n, d in G.nodes(data=True)]
+    edges = [
+        {"source": a, "target": b, "weight": round(float(d.get("weight", 0.0)), 4), "weak": bool(d.get("dashes"))}
+        for a, b, d in G.edges(data=True)
+    ]
+    return {"nodes": nodes, "edges": edges}
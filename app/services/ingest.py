@@ -0,0 +1,246 @@
+"""Streaming ingest pipeline: read → clean → chunk → embed → upsert.
+
+A reader thread decodes sources, writes raw copies, cleans and chunks them, and hands
+batches of chunks to the caller's thread through a bounded queue, so file I/O overlaps
+with embedding calls and memory stays bounded by the queue size. Every batch is committed
+on its own; documents whose chunks are all committed are appended to the run's checkpoint
+file (see `checkpoint_for`), so retrying a failed run skips them. The checkpoint is removed
+when the run completes. With `workers` > 0 the CPU-bound part
+(decode, clean, hash, chunk; see `prepare`) runs in a process pool.
+
+Exact duplicates (same normalised content) are dropped before any embedding call and
+near duplicates are linked or dropped according to `dedup.DEDUP_NEAR_MODE`.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import deque
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+from .chunking import items_from_windows, iter_chunks
+from .vector_store import upsert_texts
+from . import dedup, metrics
+
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "256"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+# One checkpoint file per run (upload), named by `checkpoint_for`
+INGEST_CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", "app/data/ingest_runs")
+# Reader/cleaner processes (0 = prepare documents in the reader thread)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+
+ProgressFn = Callable[[Dict[str, int]], None]
+
+_DONE = object()
+
+
+def doc_id(name: str, text: str) -> str:
+    """Content-derived id, so a re-upload of the same file maps to the same document."""
+    return f"{name}#{hashlib.sha1(text.encode('utf-8', errors='ignore')).hexdigest()[:8]}"
+
+
+def checkpoint_for(keys: Iterable[str], directory: str = INGEST_CHECKPOINT_DIR) -> str:
+    """Checkpoint path of the run identified by `keys` (e.g. file names and sizes)."""
+    h = hashlib.sha1()
+    for k in sorted(keys):
+        h.update(k.encode("utf-8", errors="ignore") + b"\0")
+    return os.path.join(directory, f"{h.hexdigest()[:16]}.txt")
+
+
+def _load_checkpoint(path: Optional[str]) -> Set[str]:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        ids = [line.rstrip("\n") for line in f if line.strip()]
+    # Documents deleted since the failed run was checkpointed must be ingested again
+    return dedup.stored(ids)
+
+
+def _append_checkpoint(path: Optional[str], ids: List[str]) -> None:
+    if not path or not ids:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(f"{i}\n" for i in ids)
+
+
+def prepare(name: str, data, clean: Optional[Callable[[str], str]] = None, skip: Optional[Set[str]] = None) -> Dict:
+    """Decode, clean, hash and chunk one source; runs in a worker process when `workers` > 0.
+
+    `data` is bytes, text, or an `os.PathLike` read here (so workers do the file I/O).
+    Documents whose id is in `skip` (already checkpointed) are only decoded.
+    """
+    if isinstance(data, os.PathLike):
+        with open(data, "rb") as f:
+            data = f.read()
+    text = data.decode("utf-8", errors="ignore") if isinstance(data, bytes) else str(data)
+    fid = doc_id(name, text)
+    if skip and fid in skip:
+        return {"name": name, "id": fid, "skipped": True}
+    cleaned = clean(text) if clean else text
+    return {
+        "name": name,
+        "id": fid,
+        "text": text,
+        "hash": dedup.content_hash(cleaned),
+        "sig": dedup.simhash(cleaned) if dedup.DEDUP_NEAR_MODE != "off" else 0,
+        "windows": list(iter_chunks(cleaned)),
+    }
+
+
+_worker_skip: Set[str] = set()
+
+
+def _init_worker(skip: Set[str]) -> None:
+    global _worker_skip
+    _worker_skip = skip
+
+
+def _prepare_pair(pair: Tuple, clean: Optional[Callable[[str], str]]) -> Dict:
+    return prepare(pair[0], pair[1], clean, _worker_skip)
+
+
+def _prepared(
+    sources: Iterable[Tuple[str, object]],
+    clean: Optional[Callable[[str], str]],
+    skip: Set[str],
+    workers: int,
+    stop: threading.Event,
+) -> Iterator[Dict]:
+    """`prepare` every source in order, in up to `workers` processes with a bounded backlog."""
+    if workers <= 0:
+        for name, data in sources:
+            yield prepare(name, data, clean, skip)
+        return
+    # spawn: the parent holds threads and SQLite/Chroma handles that must not be forked
+    with multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(skip,)) as pool:
+        pending: deque = deque()
+        it = iter(sources)
+        exhausted = False
+        while not stop.is_set():
+            while not exhausted and len(pending) < workers * 4:
+                try:
+                    pending.append(pool.apply_async(_prepare_pair, (next(it), clean)))
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                return
+            yield pending.popleft().get()
+
+
+@metrics.traced("ingest", is_request=True)
+def run_ingest(
+    sources: Iterable[Tuple[str, bytes]],
+    raw_dir: str,
+    clean: Optional[Callable[[str], str]] = None,
+    on_progress: Optional[ProgressFn] = None,
+    checkpoint_path: Optional[str] = None,
+    batch_chunks: int = INGEST_BATCH_CHUNKS,
+    queue_size: int = INGEST_QUEUE_SIZE,
+    workers: int = INGEST_WORKERS,
+) -> Dict[str, int]:
+    """Ingest (filename, bytes) sources and return per-stage counters.
+
+    `on_progress` is always called from the calling thread (safe for Streamlit widgets).
+    If embedding or upserting fails the exception propagates after the reader stops and
+    already committed documents stay in `checkpoint_path`; running again with the same path
+    resumes, and a completed run deletes it. With `workers` > 0, `clean` must
+    be a module-level function (it is sent to the worker processes).
+    """
+    done_ids = _load_checkpoint(checkpoint_path)
+    stats = {"read": 0, "skipped": 0, "duplicates": 0, "near_duplicates": 0, "chunks": 0, "embedded": 0, "committed": 0}
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, int(queue_size)))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    os.makedirs(raw_dir, exist_ok=True)
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _reader() -> None:
+        batch: List[Dict] = []
+        finished: List[Tuple[str, str, int]] = []
+        seen_hashes: Set[str] = set()
+        # Near-duplicate candidates among this run's documents, banded like the stored index
+        pending = dedup.RunIndex()
+        try:
+            for doc in _prepared(sources, clean, done_ids, int(workers), stop):
+                if stop.is_set():
+                    return
+                stats["read"] += 1
+                if doc.get("skipped"):
+                    stats["skipped"] += 1
+                    continue
+                name, text, fid, h, sig = doc["name"], doc["text"], doc["id"], doc["hash"], doc["sig"]
+                if h in seen_hashes or dedup.find_exact(h):
+                    stats["duplicates"] += 1
+                    continue
+                seen_hashes.add(h)
+                meta = {"title": name, "content_hash": h}
+                if dedup.DEDUP_NEAR_MODE != "off":
+                    near = dedup.find_near(sig) or pending.find_near(sig)
+                    if near:
+                        stats["near_duplicates"] += 1
+                        if dedup.DEDUP_NEAR_MODE == "skip":
+                            continue
+                        meta["version_of"], meta["near_dup_distance"] = near
+                    pending.add(fid, sig)
+                path = os.path.join(raw_dir, f"{fid}.txt")
+                # Names may be relative paths (e.g. from the CLI): mirror their directories
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as out:
+                    out.write(text)
+                meta["source"] = path
+                for ch in items_from_windows(fid, meta, doc["windows"]):
+                    batch.append(ch)
+                    stats["chunks"] += 1
+                    if len(batch) >= batch_chunks:
+                        if not _put((batch, finished)):
+                            return
+                        batch, finished = [], []
+                # The document is complete once the batch holding its last chunk commits
+                finished.append((fid, h, sig))
+            if batch or finished:
+                _put((batch, finished))
+        except BaseException as e:  # surfaced in the caller's thread
+            errors.append(e)
+        finally:
+            _put(_DONE)
+
+    reader = threading.Thread(target=_reader, name="ingest-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                if on_progress:
+                    on_progress(dict(stats))
+                continue
+            if item is _DONE:
+                break
+            chunks, finished = item
+            with metrics.span("ingest.commit", chunks=len(chunks), docs=len(finished)):
+                if chunks:
+                    upsert_texts(chunks)
+                    stats["embedded"] += len(chunks)
+                dedup.add(finished)
+                _append_checkpoint(checkpoint_path, [f[0] for f in finished])
+            stats["committed"] += len(finished)
+            if on_progress:
+                on_progress(dict(stats))
+    finally:
+        stop.set()
+        reader.join(timeout=5)
+    metrics.annotate(**stats)
+    if errors:
+        raise errors[0]
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
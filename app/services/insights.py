@@ -1,9 +1,24 @@
 import os, json
 import re
-from openai import OpenAI
-from typing import List, Dict
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Optional
+from tenacity import retry, stop_after_attempt, retry_if_exception_type
+from openai import APITimeoutError, APIConnectionError, RateLimitError
+from .clients import get_openai_client
+from . import llm_cache, metrics, scheduler, tokens
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# One chat request per topic cluster of the context, at most this many, run concurrently
+QUIZ_MAX_SHARDS = int(os.getenv("QUIZ_MAX_SHARDS", "4"))
+QUIZ_MAX_WORKERS = int(os.getenv("QUIZ_MAX_WORKERS", "4"))
+QUIZ_MAX_GAPS = int(os.getenv("QUIZ_MAX_GAPS", "5"))
+CHAT_TEMPERATURE = 0.4
+# Completion tokens reserved per chat call before the real usage is known
+CHAT_COMPLETION_ESTIMATE = int(os.getenv("CHAT_COMPLETION_ESTIMATE", "1200"))
+
+# Snippets are joined with this in the prompt (context.build_context counts its tokens)
+SEPARATOR = "\n---\n"
 
 # Note: Double braces {{ }} are required to keep literal braces when using str.format
 SYSTEM_PROMPT_TMPL = (
@@ -30,16 +45,7 @@ def _extract_json(text: str) -> str:
     return text.replace("```", "").strip()
 
 
-def generate_gaps_and_quiz(summary: str, snippets: List[str], quiz_n: int = 3) -> Dict:
-    user = f"【要約】：\n{summary}\n\n【参考メモ（抜粋）】：\n" + "\n---\n".join(snippets[:5])
-    system_prompt = SYSTEM_PROMPT_TMPL.format(quiz_n=max(1, int(quiz_n)))
-    res = client.chat.completions.create(
-        model=os.getenv("OPENAI_MODEL_CHAT", "gpt-4o-mini"),
-        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user}],
-        temperature=0.4,
-        response_format={"type": "json_object"},
-    )
-    content = res.choices[0].message.content
+def _parse(content: str) -> Dict:
     # Try direct parse, then sanitized fallback
     try:
         data = json.loads(content)
@@ -53,6 +59,183 @@ def generate_gaps_and_quiz(summary: str, snippets: List[str], quiz_n: int = 3) -
                 data = {"gaps": [], "quiz": []}
         except Exception:
             data = {"gaps": [], "quiz": []}
+    return data
+
+
+# Same transient-error policy as embeddings; each attempt waits for its own scheduler slot
+@retry(
+    wait=scheduler.retry_wait,
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type((APITimeoutError, APIConnectionError, RateLimitError)),
+    before_sleep=metrics.retry_hook("openai.chat"),
+)
+def _create_chat(model: str, messages: List[Dict], temperature: float):
+    # Reservation only: the reported usage settles it, so the cheap estimate is enough
+    estimate = sum(tokens.count_many([m["content"] for m in messages], exact=False)) + 4 * len(messages) + CHAT_COMPLETION_ESTIMATE
+    with scheduler.slot("chat", estimate, scheduler.INTERACTIVE) as slot:
+        res = get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+        )
+        slot.settle(getattr(getattr(res, "usage", None), "total_tokens", None))
+    return res
+
+
+def _chat_json(system_prompt: str, user: str, temperature: float = CHAT_TEMPERATURE) -> Dict:
+    """One JSON-mode chat call; parsed responses are cached by a hash of the full prompt."""
+    model = os.getenv("OPENAI_MODEL_CHAT", "gpt-4o-mini")
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user}]
+    key = llm_cache.make_key(model, messages, temperature, response_format="json_object")
+    hit = llm_cache.get(key)
+    if hit is not None:
+        metrics.incr("llm_cache.hits")
+        hit["_usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0, "cached": True}
+        return hit
+    t0 = time.perf_counter()
+    with metrics.span("openai.chat", model=model) as sp:
+        res = _create_chat(model, messages, temperature)
+        usage = getattr(res, "usage", None)
+        sp.set(
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+        )
+    metrics.incr("openai.chat.calls")
+    tokens.record("chat", getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+    content = res.choices[0].message.content
+    data = _parse(content)
     # Attach raw response for debugging in UI
     data["_raw"] = content
+    data["_usage"] = {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    # Unparseable answers are not cached, so a retry asks again
+    if data.get("gaps") or data.get("quiz"):
+        llm_cache.put(key, data)
+    return data
+
+
+def generate_gaps_and_quiz(summary: str, snippets: List[str], quiz_n: int = 3, sources: Optional[List[Dict]] = None) -> Dict:
+    """Ask the chat model for gaps and a quiz grounded in `snippets`.
+
+    Snippets are sent as given; select and budget them with `context.build_context`.
+    `sources` (from the same call) is passed through as `_sources` in the result.
+    """
+    user = f"【要約】：\n{summary}\n\n【参考メモ（抜粋）】：\n" + SEPARATOR.join(snippets)
+    system_prompt = SYSTEM_PROMPT_TMPL.format(quiz_n=max(1, int(quiz_n)))
+    data = _chat_json(system_prompt, user)
+    data["_sources"] = sources or []
+    return data
+
+
+def _dedup_key(text: str) -> str:
+    return re.sub(r"[\W_]+", "", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def _shards(sources: List[Dict], n_snippets: int, max_shards: int) -> List[List[int]]:
+    """Snippet indices grouped by topic cluster, merged smallest-first into at most `max_shards` groups."""
+    groups: Dict[int, List[int]] = {}
+    for i in range(n_snippets):
+        c = sources[i].get("cluster", -1) if i < len(sources) else -1
+        groups.setdefault(c, []).append(i)
+    shards = sorted(groups.values(), key=len, reverse=True)
+    max_shards = max(1, int(max_shards))
+    while len(shards) > max_shards:
+        smallest = shards.pop()
+        target = min(range(len(shards)), key=lambda j: len(shards[j]))
+        shards[target] = sorted(shards[target] + smallest)
+    return shards
+
+
+def _allocate(total: int, sizes: List[int]) -> List[int]:
+    """Split `total` questions over shards in proportion to their size, at least one each."""
+    n = len(sizes)
+    out = [1] * n
+    for _ in range(max(0, total - n)):
+        # Give the next question to the shard furthest below its proportional share
+        j = max(range(n), key=lambda k: sizes[k] / sum(sizes) * total - out[k])
+        out[j] += 1
+    return out
+
+
+def _merge(parts: List[Dict], quiz_n: int) -> Dict:
+    gaps: List = []
+    quiz: List[Dict] = []
+    seen_gaps, seen_q = set(), set()
+    for d in parts:
+        for g in d.get("gaps", []) or []:
+            k = _dedup_key(g.get("text") or g.get("title") or str(g) if isinstance(g, dict) else str(g))
+            if k and k not in seen_gaps:
+                seen_gaps.add(k)
+                gaps.append(g)
+        for qz in d.get("quiz", []) or []:
+            k = _dedup_key(qz.get("question", "") if isinstance(qz, dict) else str(qz))
+            if k and k not in seen_q and isinstance(qz, dict):
+                seen_q.add(k)
+                quiz.append(qz)
+    return {"gaps": gaps[:QUIZ_MAX_GAPS], "quiz": quiz[: max(1, int(quiz_n))]}
+
+
+def generate_sharded(
+    summary: str,
+    snippets: List[str],
+    quiz_n: int = 3,
+    sources: Optional[List[Dict]] = None,
+    max_shards: int = QUIZ_MAX_SHARDS,
+    max_workers: int = QUIZ_MAX_WORKERS,
+    on_progress: Optional[Callable[[Dict, int, int], None]] = None,
+) -> Dict:
+    """Like `generate_gaps_and_quiz`, but one concurrent request per topic cluster of the snippets.
+
+    Clusters come from `sources[i]["cluster"]` (see `context.build_context`). Questions are
+    split across shards by size; gaps and questions are merged and de-duplicated.
+    `on_progress(partial, done, total)` runs in the calling thread as each shard finishes.
+    Each shard's response is cached (see `_chat_json`), so an identical rerun makes no calls.
+    """
+    with metrics.request("insights.generate", quiz_n=int(quiz_n), snippets=len(snippets)):
+        data = _generate_sharded(summary, snippets, quiz_n, sources, max_shards, max_workers, on_progress)
+        metrics.annotate(shards=data["_usage"]["shards"], cached=data["_usage"]["cached"])
+    return data
+
+
+def _generate_sharded(
+    summary: str,
+    snippets: List[str],
+    quiz_n: int,
+    sources: Optional[List[Dict]],
+    max_shards: int,
+    max_workers: int,
+    on_progress: Optional[Callable[[Dict, int, int], None]],
+) -> Dict:
+    sources = sources or []
+    quiz_n = max(1, int(quiz_n))
+    shards = _shards(sources, len(snippets), min(int(max_shards), quiz_n)) if snippets else [[]]
+    counts = _allocate(quiz_n, [max(1, len(s)) for s in shards])
+
+    def _run(idx: List[int], n: int) -> Dict:
+        return generate_gaps_and_quiz(summary, [snippets[i] for i in idx], quiz_n=n)
+
+    results: List[Optional[Dict]] = [None] * len(shards)
+    done_order: List[Dict] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(shards)))) as pool:
+        futures = {pool.submit(metrics.bind(_run), idx, n): j for j, (idx, n) in enumerate(zip(shards, counts))}
+        for fut in as_completed(futures):
+            results[futures[fut]] = fut.result()
+            done_order.append(results[futures[fut]])
+            if on_progress:
+                on_progress(_merge(done_order, quiz_n), len(done_order), len(shards))
+    parts = [r for r in results if r is not None]
+    data = _merge(parts, quiz_n)
+    data["_raw"] = "\n\n".join(p.get("_raw", "") for p in parts)
+    data["_usage"] = {
+        "prompt_tokens": sum(p["_usage"].get("prompt_tokens") or 0 for p in parts),
+        "completion_tokens": sum(p["_usage"].get("completion_tokens") or 0 for p in parts),
+        "seconds": max((p["_usage"].get("seconds") or 0.0 for p in parts), default=0.0),
+        "cached": sum(1 for p in parts if p["_usage"].get("cached")),
+        "shards": len(parts),
+    }
+    data["_sources"] = sources
     return data
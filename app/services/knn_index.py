@@ -0,0 +1,164 @@
+"""Corpus-level kNN graph: each stored row's top-k neighbours, kept next to the Chroma collection.
+
+`vector_store` feeds it neighbour lists for newly upserted rows and removes rows on delete;
+`graph.build_graph` reads edges for a node set by lookup instead of recomputing similarities.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+
+KNN_INDEX_K = int(os.getenv("KNN_INDEX_K", "20"))
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def open_index(persist_dir: str) -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        os.makedirs(persist_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(persist_dir, "knn_graph.sqlite3"), check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS edges (src TEXT NOT NULL, dst TEXT NOT NULL, sim REAL NOT NULL,"
+            " PRIMARY KEY (src, dst)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS edges_dst ON edges(dst)")
+        conn.commit()
+        _conn = conn
+
+
+def _chunks(seq: List[str], size: int = 500) -> Iterable[List[str]]:
+    for start in range(0, len(seq), size):
+        yield seq[start : start + size]
+
+
+def _trim(conn: sqlite3.Connection, src: str, k: int) -> None:
+    conn.execute(
+        "DELETE FROM edges WHERE src=? AND dst NOT IN"
+        " (SELECT dst FROM edges WHERE src=? ORDER BY sim DESC LIMIT ?)",
+        (src, src, k),
+    )
+
+
+def add(neighbors: Dict[str, List[Tuple[str, float]]], k: int = KNN_INDEX_K) -> None:
+    """Insert neighbour lists for new rows and offer each new row to its neighbours' lists.
+
+    Only the given rows are touched: every other list changes only if a new row beats its k-th entry.
+    """
+    if _conn is None or not neighbors:
+        return
+    k = max(1, int(k))
+    with _lock:
+        conn = _conn
+        srcs = list(neighbors.keys())
+        # A re-upserted row has a new vector: drop its old edges in both directions, as `remove` does
+        for part in _chunks(srcs):
+            marks = ",".join("?" * len(part))
+            conn.execute(f"DELETE FROM edges WHERE src IN ({marks}) OR dst IN ({marks})", part + part)
+        rows = []
+        touched = set()
+        for src, nbrs in neighbors.items():
+            for dst, sim in nbrs:
+                if dst == src:
+                    continue
+                rows.append((src, dst, float(sim)))
+                rows.append((dst, src, float(sim)))
+                touched.add(dst)
+            touched.add(src)
+        conn.executemany("INSERT OR REPLACE INTO edges (src, dst, sim) VALUES (?, ?, ?)", rows)
+        for src in touched:
+            _trim(conn, src, k)
+        conn.commit()
+
+
+def remove(ids: List[str]) -> None:
+    """Drop rows and every edge pointing at them."""
+    if _conn is None or not ids:
+        return
+    with _lock:
+        for part in _chunks(list(set(ids))):
+            marks = ",".join("?" * len(part))
+            _conn.execute(f"DELETE FROM edges WHERE src IN ({marks}) OR dst IN ({marks})", part + part)
+        _conn.commit()
+
+
+def clear() -> None:
+    if _conn is None:
+        return
+    with _lock:
+        _conn.execute("DELETE FROM edges")
+        _conn.commit()
+
+
+def edge_count() -> int:
+    if _conn is None:
+        return 0
+    with _lock:
+        return int(_conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0])
+
+
+def edges_among(ids: Optional[List[str]] = None, k: int = 0) -> List[Tuple[str, str, float, bool]]:
+    """Undirected edges between the given ids (or the whole corpus when `ids` is None).
+
+    Returns (a, b, sim, mutual) with a < b, where `mutual` means each endpoint is within
+    the other's top-`k` stored neighbours (`k <= 0` means the whole stored list).
+    """
+    if _conn is None:
+        return []
+    with _lock:
+        if ids is None:
+            rows = _conn.execute("SELECT src, dst, sim FROM edges").fetchall()
+        else:
+            rows = []
+            for part in _chunks(list(dict.fromkeys(ids))):
+                marks = ",".join("?" * len(part))
+                rows.extend(_conn.execute(f"SELECT src, dst, sim FROM edges WHERE src IN ({marks})", part))
+    node_set = None if ids is None else set(ids)
+    # Rank each source's list by similarity (stored lists are already bounded by KNN_INDEX_K)
+    lists: Dict[str, List[Tuple[str, float]]] = {}
+    for src, dst, sim in rows:
+        lists.setdefault(src, []).append((dst, sim))
+    in_topk = set()
+    for src, nbrs in lists.items():
+        nbrs.sort(key=lambda x: x[1], reverse=True)
+        for dst, _ in (nbrs[:k] if k > 0 else nbrs):
+            in_topk.add((src, dst))
+    out: List[Tuple[str, str, float, bool]] = []
+    seen = set()
+    for src, dst, sim in rows:
+        if node_set is not None and dst not in node_set:
+            continue
+        # Either direction may have been trimmed away; emit each pair once
+        a, b = (src, dst) if src < dst else (dst, src)
+        if (a, b) in seen:
+            continue
+        seen.add((a, b))
+        out.append((a, b, float(sim), (a, b) in in_topk and (b, a) in in_topk))
+    return out
+
+
+def backup(path: str) -> None:
+    """Copy the index into a standalone SQLite file (used by `snapshot`)."""
+    if _conn is None:
+        return
+    with _lock:
+        dest = sqlite3.connect(path)
+        try:
+            _conn.backup(dest)
+        finally:
+            dest.close()
+
+
+def restore_from(path: str) -> None:
+    """Replace the index contents with a file written by `backup`."""
+    if _conn is None or not os.path.exists(path):
+        return
+    with _lock:
+        src = sqlite3.connect(path)
+        try:
+            src.backup(_conn)
+        finally:
+            src.close()
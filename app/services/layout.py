@@ -0,0 +1,161 @@
+"""Server-side node layout for large maps (rendered with physics disabled).
+
+Seeds new nodes from a 2-D PCA projection of their embeddings (or from already placed
+neighbours), then runs a vectorised force-directed refinement that only moves new nodes.
+Positions are remembered per node id (least recently used dropped beyond LAYOUT_CACHE_SIZE;
+deleted rows are forgotten by the store), so a repeated node set is a lookup and existing
+nodes keep their place when new ones are added.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import os
+import threading
+import numpy as np
+
+# build_graph(layout="auto") switches to the precomputed layout above this many nodes
+LAYOUT_NODE_THRESHOLD = int(os.getenv("LAYOUT_NODE_THRESHOLD", "200"))
+LAYOUT_ITERATIONS = int(os.getenv("LAYOUT_ITERATIONS", "60"))
+# Exact O(n^2) repulsion up to this size, sampled repulsion above it
+LAYOUT_EXACT_MAX_N = 1000
+LAYOUT_NEGATIVE_SAMPLES = 10
+LAYOUT_SCALE = 1000.0
+# Node positions remembered across maps
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "50000"))
+
+_positions: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def missing(ids: Sequence[str]) -> List[str]:
+    """Ids that have no remembered position yet."""
+    with _lock:
+        return [i for i in ids if i not in _positions]
+
+
+def forget(ids: Optional[Sequence[str]] = None) -> None:
+    """Drop remembered positions of `ids` (all of them if None), e.g. for deleted rows."""
+    with _lock:
+        if ids is None:
+            _positions.clear()
+        else:
+            for i in ids:
+                _positions.pop(i, None)
+
+
+def _pca2(X: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Top-2 principal components via a randomised range finder (cheap for n×1536 inputs)."""
+    n = X.shape[0]
+    if n == 0 or X.shape[1] == 0:
+        return np.zeros((n, 2), dtype=np.float32)
+    Xc = X - X.mean(axis=0, keepdims=True)
+    rng = np.random.default_rng(seed)
+    Q = Xc @ rng.standard_normal((Xc.shape[1], min(8, Xc.shape[1]))).astype(np.float32)
+    for _ in range(2):
+        Q, _ = np.linalg.qr(Xc @ (Xc.T @ Q))
+    B = Q.T @ Xc
+    _, _, Vt = np.linalg.svd(B, full_matrices=False)
+    Y = Xc @ Vt[:2].T
+    if Y.shape[1] < 2:
+        Y = np.hstack([Y, np.zeros((n, 2 - Y.shape[1]), dtype=Y.dtype)])
+    return Y.astype(np.float32)
+
+
+def _refine(pos: np.ndarray, movable: np.ndarray, src: np.ndarray, dst: np.ndarray, w: np.ndarray, iterations: int) -> np.ndarray:
+    """Fruchterman–Reingold style iterations over edge arrays; pinned rows never move."""
+    n = pos.shape[0]
+    if n < 2 or not movable.any():
+        return pos
+    k = LAYOUT_SCALE / np.sqrt(n)
+    rng = np.random.default_rng(0)
+    temp = LAYOUT_SCALE / 10.0
+    for _ in range(max(0, int(iterations))):
+        disp = np.zeros_like(pos)
+        if n <= LAYOUT_EXACT_MAX_N:
+            delta = pos[:, None, :] - pos[None, :, :]
+            d2 = np.maximum((delta ** 2).sum(-1), 1e-2)
+            disp += (delta * (k * k / d2)[..., None]).sum(axis=1)
+        else:
+            j = rng.integers(0, n, size=(n, LAYOUT_NEGATIVE_SAMPLES))
+            delta = pos[:, None, :] - pos[j]
+            d2 = np.maximum((delta ** 2).sum(-1), 1e-2)
+            # Scale the sampled force up to the expected full-population repulsion
+            disp += (delta * (k * k / d2)[..., None]).sum(axis=1) * (n / LAYOUT_NEGATIVE_SAMPLES)
+        if src.size:
+            delta = pos[dst] - pos[src]
+            dist = np.sqrt(np.maximum((delta ** 2).sum(-1), 1e-6))
+            f = delta * (dist * w / k)[:, None]
+            np.add.at(disp, src, f)
+            np.add.at(disp, dst, -f)
+        length = np.sqrt(np.maximum((disp ** 2).sum(-1), 1e-9))
+        step = disp * (np.minimum(length, temp) / length)[:, None]
+        pos[movable] += step[movable]
+        temp *= 0.95
+    return pos
+
+
+def compute_layout(
+    ids: Sequence[str],
+    edges: Sequence[Tuple[str, str, float]],
+    embs: Optional[Dict[str, List[float]]] = None,
+    iterations: int = LAYOUT_ITERATIONS,
+) -> Dict[str, Tuple[float, float]]:
+    """Return {id: (x, y)} for all ids; only nodes without a remembered position are placed."""
+    ids = list(dict.fromkeys(ids))
+    with _lock:
+        known = {i: _positions[i] for i in ids if i in _positions}
+        for i in known:
+            _positions.move_to_end(i)
+    if len(known) == len(ids):
+        return known
+    n = len(ids)
+    index = {nid: i for i, nid in enumerate(ids)}
+    pos = np.zeros((n, 2), dtype=np.float32)
+    movable = np.ones(n, dtype=bool)
+    for nid, xy in known.items():
+        pos[index[nid]] = xy
+        movable[index[nid]] = False
+    new_idx = np.nonzero(movable)[0]
+
+    # Seed new nodes from a PCA projection of their embeddings
+    embs = embs or {}
+    dim = next((len(e) for e in embs.values() if e is not None and len(e)), 0)
+    seed = np.random.default_rng(len(ids)).standard_normal((n, 2)).astype(np.float32) * LAYOUT_SCALE / 4
+    if dim:
+        X = np.zeros((n, dim), dtype=np.float32)
+        for i, nid in enumerate(ids):
+            e = embs.get(nid)
+            if e is not None and len(e) == dim:
+                X[i] = e
+        Y = _pca2(X)
+        pinned = np.nonzero(~movable)[0]
+        if pinned.size >= 3:
+            # Map PCA coordinates onto the existing layout with a least-squares affine fit
+            A = np.hstack([Y[pinned], np.ones((pinned.size, 1), dtype=np.float32)])
+            coef, *_ = np.linalg.lstsq(A, pos[pinned], rcond=None)
+            seed = np.hstack([Y, np.ones((n, 1), dtype=np.float32)]) @ coef
+        else:
+            spread = np.abs(Y).max() or 1.0
+            seed = Y / spread * (LAYOUT_SCALE / 2)
+    pos[new_idx] = seed[new_idx]
+
+    src = np.array([index[a] for a, b, _ in edges if a in index and b in index], dtype=np.int64)
+    dst = np.array([index[b] for a, b, _ in edges if a in index and b in index], dtype=np.int64)
+    w = np.array([max(0.0, float(s)) for a, b, s in edges if a in index and b in index], dtype=np.float32)
+    # New nodes with placed neighbours start at their neighbours' mean
+    if known and src.size:
+        acc = np.zeros((n, 2), dtype=np.float32)
+        cnt = np.zeros(n, dtype=np.float32)
+        for s_, d_ in ((src, dst), (dst, src)):
+            sel = movable[s_] & ~movable[d_]
+            np.add.at(acc, s_[sel], pos[d_[sel]])
+            np.add.at(cnt, s_[sel], 1.0)
+        has = movable & (cnt > 0)
+        pos[has] = acc[has] / cnt[has][:, None]
+
+    pos = _refine(pos, movable, src, dst, w, iterations)
+    out = {nid: (float(pos[i, 0]), float(pos[i, 1])) for i, nid in enumerate(ids)}
+    with _lock:
+        _positions.update({nid: out[nid] for nid in (ids[i] for i in new_idx)})
+        while len(_positions) > LAYOUT_CACHE_SIZE:
+            _positions.popitem(last=False)
+    return out
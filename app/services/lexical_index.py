@@ -0,0 +1,170 @@
+"""Local inverted index for keyword search (BM25), kept next to the Chroma collection.
+
+Terms are ASCII words plus character bigrams of every other run of letters, so Japanese
+and formula-like tokens match without a morphological analyser. `vector_store` keeps it
+in sync with upserts and deletes; `vector_store.search` fuses it with vector results.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import Counter
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+LEX_NGRAM = 2
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+# (doc count, average length), recomputed after writes
+_stats: Optional[Tuple[int, float]] = None
+
+_RUN = re.compile(r"[0-9a-z_]+|[^\W0-9a-z_]+")
+
+
+def terms(text: str) -> List[str]:
+    """Index terms of `text`: ASCII words as-is, other letter runs as character bigrams."""
+    out: List[str] = []
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    for m in _RUN.finditer(s):
+        run = m.group(0)
+        if run.isascii() or len(run) < LEX_NGRAM:
+            out.append(run)
+        else:
+            out.extend(run[i : i + LEX_NGRAM] for i in range(len(run) - LEX_NGRAM + 1))
+    return out
+
+
+def open_index(persist_dir: str) -> None:
+    global _conn, _stats
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        os.makedirs(persist_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(persist_dir, "lexical.sqlite3"), check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc TEXT NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, doc)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc)")
+        conn.execute("CREATE TABLE IF NOT EXISTS docs (doc TEXT PRIMARY KEY, len INTEGER NOT NULL)")
+        conn.commit()
+        _conn = conn
+        _stats = None
+
+
+def _chunks(seq: List[str], size: int = 500) -> Iterable[List[str]]:
+    for start in range(0, len(seq), size):
+        yield seq[start : start + size]
+
+
+def _delete(conn: sqlite3.Connection, ids: List[str]) -> None:
+    for part in _chunks(ids):
+        marks = ",".join("?" * len(part))
+        conn.execute(f"DELETE FROM postings WHERE doc IN ({marks})", part)
+        conn.execute(f"DELETE FROM docs WHERE doc IN ({marks})", part)
+
+
+def add(ids: List[str], documents: List[str]) -> None:
+    """Index (or re-index) rows by id."""
+    global _stats
+    if _conn is None or not ids:
+        return
+    postings = []
+    lengths = []
+    for _id, doc in zip(ids, documents):
+        tf = Counter(terms(doc))
+        postings.extend((t, _id, c) for t, c in tf.items())
+        lengths.append((_id, sum(tf.values())))
+    with _lock:
+        _delete(_conn, list(ids))
+        _conn.executemany("INSERT OR REPLACE INTO postings (term, doc, tf) VALUES (?, ?, ?)", postings)
+        _conn.executemany("INSERT OR REPLACE INTO docs (doc, len) VALUES (?, ?)", lengths)
+        _conn.commit()
+        _stats = None
+
+
+def remove(ids: List[str]) -> None:
+    global _stats
+    if _conn is None or not ids:
+        return
+    with _lock:
+        _delete(_conn, list(dict.fromkeys(ids)))
+        _conn.commit()
+        _stats = None
+
+
+def clear() -> None:
+    global _stats
+    if _conn is None:
+        return
+    with _lock:
+        _conn.execute("DELETE FROM postings")
+        _conn.execute("DELETE FROM docs")
+        _conn.commit()
+        _stats = None
+
+
+def doc_count() -> int:
+    return _corpus_stats()[0]
+
+
+def _corpus_stats() -> Tuple[int, float]:
+    global _stats
+    if _conn is None:
+        return 0, 0.0
+    with _lock:
+        if _stats is None:
+            n, avg = _conn.execute("SELECT COUNT(*), AVG(len) FROM docs").fetchone()
+            _stats = (int(n or 0), float(avg or 0.0))
+        return _stats
+
+
+def search(query: str, limit: int = 50) -> List[Tuple[str, float]]:
+    """Top `limit` row ids by BM25 score for `query`, best first."""
+    q = Counter(terms(query))
+    n, avgdl = _corpus_stats()
+    if _conn is None or not q or n == 0:
+        return []
+    scores: Dict[str, float] = {}
+    with _lock:
+        for term, qtf in q.items():
+            rows = _conn.execute(
+                "SELECT p.doc, p.tf, d.len FROM postings p JOIN docs d ON d.doc = p.doc WHERE p.term=?", (term,)
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1.0 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            for doc, tf, dl in rows:
+                denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * dl / max(avgdl, 1e-9))
+                scores[doc] = scores.get(doc, 0.0) + qtf * idf * tf * (BM25_K1 + 1.0) / denom
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[: max(0, int(limit))]
+
+
+def backup(path: str) -> None:
+    """Copy the index into a standalone SQLite file (used by `snapshot`)."""
+    if _conn is None:
+        return
+    with _lock:
+        dest = sqlite3.connect(path)
+        try:
+            _conn.backup(dest)
+        finally:
+            dest.close()
+
+
+def restore_from(path: str) -> None:
+    """Replace the index contents with a file written by `backup`."""
+    global _stats
+    if _conn is None or not os.path.exists(path):
+        return
+    with _lock:
+        src = sqlite3.connect(path)
+        try:
+            src.backup(_conn)
+        finally:
+            src.close()
+        _stats = None
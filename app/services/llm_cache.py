@@ -0,0 +1,44 @@
+"""On-disk cache of parsed chat responses keyed by a hash of the full prompt."""
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+from .sqlite_lru import LRUStore
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "app/data/cache/llm.sqlite3")
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+
+
+def make_key(model: str, messages: List[Dict], temperature: float, **params) -> str:
+    """Hash of everything that determines the response (model, messages, sampling, format)."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, **params},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_store = LRUStore(
+    CACHE_PATH, "llm", CACHE_MAX_ENTRIES, lambda v: json.dumps(v, ensure_ascii=False), json.loads, enabled=CACHE_ENABLED
+)
+
+
+def get(key: str) -> Optional[Dict]:
+    """Cached value for `key` (bumping its LRU timestamp), or None."""
+    return _store.get_many([key]).get(key)
+
+
+def put(key: str, value: Dict) -> None:
+    """Store a JSON-serialisable value, evicting least recently used rows over the size bound."""
+    _store.put_many({key: value})
+
+
+def stats() -> Dict[str, int]:
+    """Return hit/miss/write/eviction counters plus the current entry count."""
+    return _store.stats()
+
+
+def clear() -> None:
+    _store.clear()
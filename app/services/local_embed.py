@@ -0,0 +1,73 @@
+"""Offline CPU embeddings: hashed character n-grams projected to a small dense vector.
+
+Each text's character 1–3-grams (NFKC, lower-cased) are hashed with vectorised NumPy
+arithmetic, weighted by sublinear term frequency and folded into LOCAL_EMBED_DIM
+dimensions by a fixed signed random projection (a count sketch with several hashes per
+feature). Nothing is fitted on the corpus, so a text always maps to the same vector and
+vectors written at different times stay comparable. No downloads, no network.
+"""
+from typing import List
+import os
+import re
+import unicodedata
+import numpy as np
+
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", "384"))
+LOCAL_NGRAMS = (1, 2, 3)
+# Projection hashes per feature; more hashes give a denser, lower-variance projection
+LOCAL_PROJECTIONS = 4
+MODEL_VERSION = "v1"
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_MULT = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def model_name(dim: int = LOCAL_EMBED_DIM) -> str:
+    return f"local-hash-ngram-{MODEL_VERSION}-{int(dim)}"
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip().lower()
+
+
+def _ngram_hashes(text: str) -> np.ndarray:
+    """64-bit hashes of all character n-grams of `text` (polynomial over code points)."""
+    cps = np.frombuffer(_normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    parts = []
+    with np.errstate(over="ignore"):
+        for n in LOCAL_NGRAMS:
+            if cps.size < n:
+                break
+            h = np.full(cps.size - n + 1, np.uint64(n), dtype=np.uint64)
+            for j in range(n):
+                h = h * _MIX + cps[j : cps.size - n + 1 + j]
+            parts.append(h)
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64)
+
+
+def _mix(h: np.ndarray, seed: int) -> np.ndarray:
+    """splitmix64-style finaliser, one independent stream per seed."""
+    with np.errstate(over="ignore"):
+        x = h + np.uint64(seed) * _MIX
+        x = (x ^ (x >> np.uint64(30))) * _MULT
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def embed(texts: List[str], dim: int = LOCAL_EMBED_DIM) -> List[List[float]]:
+    """Unit-length float vectors for `texts`, in order (empty text → zero vector)."""
+    dim = max(1, int(dim))
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        feats, counts = np.unique(_ngram_hashes(text), return_counts=True)
+        if feats.size == 0:
+            continue
+        w = (1.0 + np.log(counts)).astype(np.float32) / np.sqrt(LOCAL_PROJECTIONS)
+        for p in range(LOCAL_PROJECTIONS):
+            x = _mix(feats, p + 1)
+            idx = (x % np.uint64(dim)).astype(np.int64)
+            sign = np.where((x >> np.uint64(63)) == 1, -1.0, 1.0).astype(np.float32)
+            out[row] += np.bincount(idx, weights=sign * w, minlength=dim).astype(np.float32)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out.tolist()
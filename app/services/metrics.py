@@ -0,0 +1,276 @@
+"""Lightweight in-process instrumentation: timed spans, counters and exports.
+
+    with metrics.request("search", mode=mode):      # a user-visible operation
+        with metrics.span("chroma.query") as sp:     # a stage inside it
+            ...
+            sp.set(rows=len(ids))
+        metrics.incr("openai.tokens", n)
+
+Every span feeds per-name rolling percentiles. A `request` span also keeps its child spans
+(same thread) and is listed in `recent()`. With METRICS_ENABLED=0 spans are a shared no-op
+object. Exports: `prometheus_text()`, `export_jsonl(fp)` and an optional `/metrics` HTTP
+endpoint (`serve(port)`, started by the app when METRICS_PORT is set).
+"""
+from typing import IO, Any, Callable, Dict, List, Optional
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False", "")
+# Durations kept per span name for rolling percentiles, and number of recent requests kept
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "512"))
+METRICS_RECENT = int(os.getenv("METRICS_RECENT", "50"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_lock = threading.Lock()
+_local = threading.local()
+_durations: Dict[str, deque] = {}
+_totals: Dict[str, List[float]] = {}  # name -> [count, seconds]
+_counters: Dict[str, float] = {}
+_recent: deque = deque(maxlen=METRICS_RECENT)
+_server: Optional[ThreadingHTTPServer] = None
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "is_request", "start", "children", "parent")
+
+    def __init__(self, name: str, attrs: Dict[str, Any], is_request: bool):
+        self.name = name
+        self.attrs = attrs
+        self.is_request = is_request
+        self.children: List[Dict] = []
+        self.parent: Optional["_Span"] = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = getattr(_local, "current", None)
+        _local.current = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _local.current = self.parent
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record = {"name": self.name, "seconds": round(seconds, 6), **self.attrs}
+        if self.children:
+            record["children"] = self.children
+        with _lock:
+            _durations.setdefault(self.name, deque(maxlen=METRICS_WINDOW)).append(seconds)
+            tot = _totals.setdefault(self.name, [0, 0.0])
+            tot[0] += 1
+            tot[1] += seconds
+            if self.parent is not None:
+                self.parent.children.append(record)
+            elif self.is_request:
+                record["at"] = time.time()
+                _recent.append(record)
+        return False
+
+
+def span(name: str, **attrs):
+    """Time a stage; attach attributes with `.set(...)` on the returned object."""
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(name, attrs, False)
+
+
+def request(name: str, **attrs):
+    """Like `span`, but a top-level one is also kept (with its child spans) in `recent()`."""
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(name, attrs, True)
+
+
+def traced(name: str, is_request: bool = False) -> Callable:
+    """Decorator form of `span` / `request` for a whole function."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name, {}, is_request):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def bind(fn: Callable) -> Callable:
+    """Wrap `fn` so spans it opens in a worker thread nest under this thread's current span."""
+    parent = getattr(_local, "current", None) if METRICS_ENABLED else None
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prev = getattr(_local, "current", None)
+        _local.current = parent
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.current = prev
+    return wrapper
+
+
+def annotate(**attrs) -> None:
+    """Set attributes on the innermost open span of this thread, if any."""
+    if METRICS_ENABLED:
+        cur = getattr(_local, "current", None)
+        if cur is not None:
+            cur.attrs.update(attrs)
+
+
+def accumulate(**values: float) -> None:
+    """Add numbers to the enclosing request span's attributes (e.g. tokens, cost_usd)."""
+    if not METRICS_ENABLED:
+        return
+    cur = getattr(_local, "current", None)
+    while cur is not None and not cur.is_request:
+        cur = cur.parent
+    if cur is None:
+        return
+    with _lock:
+        for k, v in values.items():
+            cur.attrs[k] = cur.attrs.get(k, 0) + v
+
+
+def incr(name: str, n: float = 1) -> None:
+    if not METRICS_ENABLED or not n:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def retry_hook(name: str) -> Callable:
+    """tenacity `before_sleep` callback counting retries of `name` (e.g. "openai.embeddings")."""
+    def _before_sleep(retry_state) -> None:
+        incr(f"{name}.retries")
+        annotate(retries=retry_state.attempt_number)
+    return _before_sleep
+
+
+def _pct(values: List[float], q: float) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))] if s else 0.0
+
+
+def summary() -> List[Dict]:
+    """Per span name: count, total seconds and rolling p50/p95/max over the last METRICS_WINDOW calls."""
+    with _lock:
+        items = [(n, list(d), list(_totals[n])) for n, d in _durations.items()]
+    out = []
+    for name, durs, (count, total) in sorted(items):
+        out.append({
+            "span": name,
+            "count": int(count),
+            "total_s": round(total, 4),
+            "p50_ms": round(_pct(durs, 0.5) * 1000, 2),
+            "p95_ms": round(_pct(durs, 0.95) * 1000, 2),
+            "max_ms": round(max(durs) * 1000, 2) if durs else 0.0,
+        })
+    return out
+
+
+def counters() -> Dict[str, float]:
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def recent(limit: int = METRICS_RECENT) -> List[Dict]:
+    """Most recent request spans, newest first."""
+    with _lock:
+        return list(_recent)[::-1][: max(0, int(limit))]
+
+
+def reset() -> None:
+    with _lock:
+        _durations.clear()
+        _totals.clear()
+        _counters.clear()
+        _recent.clear()
+
+
+def _prom_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus_text() -> str:
+    """All spans and counters in the Prometheus text exposition format."""
+    lines = [
+        "# HELP kmap_span_seconds Wall time of instrumented stages (rolling window quantiles).",
+        "# TYPE kmap_span_seconds summary",
+    ]
+    with _lock:
+        items = [(n, list(d), list(_totals[n])) for n, d in _durations.items()]
+        cnt = dict(_counters)
+    for name, durs, (count, total) in sorted(items):
+        for q in (0.5, 0.95):
+            lines.append(f'kmap_span_seconds{{span="{name}",quantile="{q}"}} {_pct(durs, q):.6f}')
+        lines.append(f'kmap_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f'kmap_span_seconds_count{{span="{name}"}} {int(count)}')
+    for name, value in sorted(cnt.items()):
+        metric = f"kmap_{_prom_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def export_jsonl(fp: IO[str]) -> int:
+    """Write recent request records (oldest first) as JSON lines; returns the number written."""
+    rows = recent()[::-1]
+    for r in rows:
+        fp.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
+    return len(rows)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body, ctype = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path.startswith("/recent"):
+            body, ctype = json.dumps(recent(), ensure_ascii=False, default=str).encode("utf-8"), "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port: int = METRICS_PORT, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics (Prometheus) and /recent (JSON) from a daemon thread; once per process."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    _server = ThreadingHTTPServer((host, int(port)), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
@@ -0,0 +1,210 @@
+"""Corpus overview: incremental spherical mini-batch k-means over stored embeddings.
+
+Centroids, cluster sizes and each row's assignment (with its similarity to the centroid at
+assignment time) live next to the Chroma collection. New rows seed clusters farthest-first
+until OVERVIEW_CLUSTERS exist, then update centroids as running means. `representatives`
+answers "show me the corpus" from this index alone, without embedding a query.
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+import numpy as np
+
+OVERVIEW_CLUSTERS = int(os.getenv("OVERVIEW_CLUSTERS", "16"))
+# A row this similar to an existing centroid never starts a new cluster
+OVERVIEW_SEED_MAX_SIM = float(os.getenv("OVERVIEW_SEED_MAX_SIM", "0.95"))
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+_centroids = np.zeros((0, 0), dtype=np.float32)
+_counts = np.zeros(0, dtype=np.int64)
+
+
+def open_index(persist_dir: str) -> None:
+    global _conn, _centroids, _counts
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        os.makedirs(persist_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(persist_dir, "overview.sqlite3"), check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS centroids (cluster INTEGER PRIMARY KEY, count INTEGER NOT NULL, vec BLOB NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS members (id TEXT PRIMARY KEY, parent TEXT NOT NULL, cluster INTEGER NOT NULL, sim REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS members_cluster ON members(cluster, sim)")
+        conn.commit()
+        rows = conn.execute("SELECT count, vec FROM centroids ORDER BY cluster").fetchall()
+        if rows:
+            _centroids = np.vstack([np.frombuffer(v, dtype=np.float32) for _, v in rows])
+            _counts = np.array([c for c, _ in rows], dtype=np.int64)
+        else:
+            _centroids, _counts = np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        _conn = conn
+
+
+def _save_centroids(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM centroids")
+    conn.executemany(
+        "INSERT INTO centroids (cluster, count, vec) VALUES (?, ?, ?)",
+        [(i, int(_counts[i]), _centroids[i].astype(np.float32).tobytes()) for i in range(_centroids.shape[0])],
+    )
+
+
+def _unit(X) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms > 0, norms, 1.0)
+
+
+def _members(conn: sqlite3.Connection, ids: List[str]) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    uniq = list(dict.fromkeys(ids))
+    for start in range(0, len(uniq), 500):
+        part = uniq[start : start + 500]
+        marks = ",".join("?" * len(part))
+        out.update(conn.execute(f"SELECT id, cluster FROM members WHERE id IN ({marks})", part).fetchall())
+    return out
+
+
+def add(ids: List[str], parents: List[str], embeddings, previous: Optional[Dict[str, List[float]]] = None) -> None:
+    """Assign rows to clusters and move the centroids towards them.
+
+    Rows that are already assigned (re-upserts) first leave their old cluster: its count is
+    decremented and, when `previous` holds the row's old vector, the running mean is undone.
+    """
+    global _centroids, _counts
+    if _conn is None or not ids:
+        return
+    X = _unit(embeddings)
+    with _lock:
+        C, counts = _centroids, _counts
+        if C.size and C.shape[1] != X.shape[1]:
+            # Embedding dimension changed: start over
+            C, counts = np.zeros((0, X.shape[1]), dtype=np.float32), np.zeros(0, dtype=np.int64)
+            _conn.execute("DELETE FROM members")
+        previous = previous or {}
+        for rid, c in _members(_conn, ids).items():
+            if c >= len(counts) or counts[c] <= 0:
+                continue
+            n = int(counts[c])
+            old = previous.get(rid)
+            if old is not None and len(old) == C.shape[1] and n > 1:
+                # Inverse of the running-mean step below
+                C[c] = (n * C[c] - _unit([old])[0]) / (n - 1)
+                C[c] /= max(float(np.linalg.norm(C[c])), 1e-12)
+            counts[c] = n - 1
+        if not C.size:
+            C = np.zeros((0, X.shape[1]), dtype=np.float32)
+        # Farthest-first seeding while there are fewer than OVERVIEW_CLUSTERS clusters
+        while C.shape[0] < OVERVIEW_CLUSTERS:
+            best = (X @ C.T).max(axis=1) if C.shape[0] else np.full(X.shape[0], -np.inf, dtype=np.float32)
+            i = int(np.argmin(best))
+            if best[i] >= OVERVIEW_SEED_MAX_SIM:
+                break
+            C = np.vstack([C, X[i : i + 1]])
+            counts = np.append(counts, 0)
+        sims = X @ C.T
+        assign = sims.argmax(axis=1)
+        for c in np.unique(assign):
+            sel = assign == c
+            n_new = int(sel.sum())
+            total = counts[c] + n_new
+            # Running mean over all rows ever assigned, renormalised (spherical k-means)
+            C[c] = C[c] + (X[sel].sum(axis=0) - n_new * C[c]) / total
+            C[c] /= max(float(np.linalg.norm(C[c])), 1e-12)
+            counts[c] = total
+        _centroids, _counts = C, counts
+        _conn.executemany(
+            "INSERT OR REPLACE INTO members (id, parent, cluster, sim) VALUES (?, ?, ?, ?)",
+            [(i, p, int(c), float(s)) for i, p, c, s in zip(ids, parents, assign, (X * C[assign]).sum(axis=1))],
+        )
+        _save_centroids(_conn)
+        _conn.commit()
+
+
+def remove(ids: List[str]) -> None:
+    if _conn is None or not ids:
+        return
+    with _lock:
+        uniq = list(dict.fromkeys(ids))
+        for start in range(0, len(uniq), 500):
+            part = uniq[start : start + 500]
+            marks = ",".join("?" * len(part))
+            for (c,) in _conn.execute(f"SELECT cluster FROM members WHERE id IN ({marks})", part).fetchall():
+                if c < len(_counts):
+                    _counts[c] = max(0, _counts[c] - 1)
+            _conn.execute(f"DELETE FROM members WHERE id IN ({marks})", part)
+        _save_centroids(_conn)
+        _conn.commit()
+
+
+def clear() -> None:
+    global _centroids, _counts
+    if _conn is None:
+        return
+    with _lock:
+        _conn.execute("DELETE FROM members")
+        _conn.execute("DELETE FROM centroids")
+        _conn.commit()
+        _centroids, _counts = np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+
+def member_count() -> int:
+    if _conn is None:
+        return 0
+    with _lock:
+        return int(_conn.execute("SELECT COUNT(*) FROM members").fetchone()[0])
+
+
+def cluster_of(ids: List[str]) -> Dict[str, int]:
+    """Cluster assignment of the given row ids (unknown ids are absent)."""
+    if _conn is None or not ids:
+        return {}
+    with _lock:
+        return _members(_conn, ids)
+
+
+def clusters() -> List[Tuple[int, int]]:
+    """(cluster, size) pairs, largest first; empty clusters are omitted."""
+    with _lock:
+        return sorted(((i, int(n)) for i, n in enumerate(_counts) if n > 0), key=lambda x: -x[1])
+
+
+def representatives(top_k: int) -> List[Tuple[str, int, float]]:
+    """Up to `top_k` (row id, cluster, similarity) picks spread over clusters, one row per document.
+
+    Clusters take turns in size order and each contributes its most central rows first,
+    so every non-empty cluster is represented before any gets a second pick.
+    """
+    if _conn is None or top_k <= 0:
+        return []
+    order = clusters()
+    if not order:
+        return []
+    per_cluster: Dict[int, List[Tuple[str, str, float]]] = {}
+    with _lock:
+        for c, _ in order:
+            per_cluster[c] = _conn.execute(
+                "SELECT id, parent, sim FROM members WHERE cluster=? ORDER BY sim DESC LIMIT ?", (c, int(top_k) * 4)
+            ).fetchall()
+    out: List[Tuple[str, int, float]] = []
+    seen = set()
+    cursor = {c: 0 for c, _ in order}
+    while len(out) < top_k:
+        progressed = False
+        for c, _ in order:
+            rows = per_cluster[c]
+            while cursor[c] < len(rows) and rows[cursor[c]][1] in seen:
+                cursor[c] += 1
+            if cursor[c] < len(rows):
+                rid, parent, sim = rows[cursor[c]]
+                cursor[c] += 1
+                seen.add(parent)
+                out.append((rid, c, float(sim)))
+                progressed = True
+                if len(out) >= top_k:
+                    break
+        if not progressed:
+            break
+    return out
@@ -0,0 +1,212 @@
+"""Process-wide admission control for OpenAI requests: token buckets plus priority classes.
+
+Every request reserves one call and its estimated tokens from the limiter of its kind
+("embeddings" or "chat") before it is sent:
+
+    with scheduler.slot("embeddings", n_tokens) as s:
+        res = client.embeddings.create(...)
+        s.settle(res.usage.prompt_tokens)
+
+Buckets refill continuously at the per-minute limits and hold at most RATE_BURST_SECONDS
+worth of budget, so all sessions together stay near the account limit instead of bursting
+into 429s. Waiters are admitted strictly by priority (INTERACTIVE before BULK), first come
+first served within a class. A 429 pauses the whole kind for the server's retry-after, and
+`settle` refunds or charges the difference between the estimate and the reported usage.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from tenacity import wait_exponential
+from . import metrics
+
+# Priority classes: lower is served first
+INTERACTIVE = 0
+BULK = 1
+
+# Account limits per kind (requests/min, tokens/min); 0 disables that bucket
+RATE_LIMITS: Dict[str, Tuple[int, int]] = {
+    "embeddings": (int(os.getenv("OPENAI_EMBED_RPM", "3000")), int(os.getenv("OPENAI_EMBED_TPM", "1000000"))),
+    "chat": (int(os.getenv("OPENAI_CHAT_RPM", "500")), int(os.getenv("OPENAI_CHAT_TPM", "200000"))),
+}
+# Largest burst a bucket allows, in seconds of its refill rate
+RATE_BURST_SECONDS = float(os.getenv("RATE_BURST_SECONDS", "5"))
+# Pause after a 429 that carries no retry-after header
+RATE_LIMIT_PAUSE = float(os.getenv("RATE_LIMIT_PAUSE", "1.0"))
+
+_local = threading.local()
+_lock = threading.Lock()
+_limiters: Dict[str, "Limiter"] = {}
+
+
+class _Bucket:
+    def __init__(self, per_minute: int, burst_seconds: float):
+        self.rate = max(0, per_minute) / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds) if self.rate else math.inf
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, need: float) -> float:
+        """Seconds until `need` can be taken (a request larger than the bucket waits for a full one)."""
+        if not self.rate:
+            return 0.0
+        return max(0.0, (min(need, self.capacity) - self.level) / self.rate)
+
+    def take(self, n: float) -> None:
+        if self.rate:
+            self.level -= n  # may go negative for oversized requests; refill pays it back
+
+    def give(self, n: float) -> None:
+        if self.rate:
+            self.level = min(self.capacity, self.level + n)
+
+
+class Limiter:
+    """Request and token buckets for one kind of call, with a priority-ordered wait queue."""
+
+    def __init__(self, kind: str, rpm: int, tpm: int, burst_seconds: float = RATE_BURST_SECONDS):
+        self.kind = kind
+        self.requests = _Bucket(rpm, burst_seconds)
+        self.tokens = _Bucket(tpm, burst_seconds)
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+    def acquire(self, tokens: int, priority: int = BULK) -> float:
+        """Block until this call may be sent; returns the seconds spent waiting."""
+        ticket = (int(priority), next(self._seq))
+        t0 = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            # A newcomer may outrank the current head: let the head re-check
+            self._cond.notify_all()
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiters[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    delay = max(self._paused_until - now, self.requests.delay(1), self.tokens.delay(tokens))
+                    if delay <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        return now - t0
+                    self._cond.wait(delay)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Correct the token bucket once the server has reported real usage."""
+        with self._cond:
+            self.tokens.refill(time.monotonic())
+            if actual > estimated:
+                self.tokens.take(actual - estimated)
+            else:
+                self.tokens.give(estimated - actual)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every waiter of this kind for `seconds` (after a 429)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+            self._cond.notify_all()
+
+
+def limiter(kind: str) -> Limiter:
+    with _lock:
+        lim = _limiters.get(kind)
+        if lim is None:
+            rpm, tpm = RATE_LIMITS.get(kind, (0, 0))
+            lim = _limiters[kind] = Limiter(kind, rpm, tpm)
+        return lim
+
+
+def configure(kind: str, rpm: int, tpm: int, burst_seconds: float = RATE_BURST_SECONDS) -> Limiter:
+    """Replace the limits of `kind` (e.g. from a benchmark or a different account tier)."""
+    with _lock:
+        lim = _limiters[kind] = Limiter(kind, rpm, tpm, burst_seconds)
+        return lim
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Run the block's OpenAI calls (in this thread) at `level`, e.g. INTERACTIVE for a user query."""
+    prev = getattr(_local, "priority", None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = prev
+
+
+def current_priority(default: int = BULK) -> int:
+    p = getattr(_local, "priority", None)
+    return default if p is None else p
+
+
+def _retry_after(exc: BaseException) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return RATE_LIMIT_PAUSE
+
+
+_backoff = wait_exponential(min=1, max=10)
+
+
+def retry_wait(retry_state) -> float:
+    """tenacity `wait`: no extra sleep after a 429 (the slot already waits out the server's
+    retry-after), exponential backoff for timeouts and connection errors."""
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if getattr(exc, "status_code", None) == 429:
+        return 0.0
+    return _backoff(retry_state)
+
+
+class _Slot:
+    __slots__ = ("limiter", "estimated")
+
+    def __init__(self, lim: Limiter, estimated: int):
+        self.limiter = lim
+        self.estimated = estimated
+
+    def settle(self, actual: Optional[int]) -> None:
+        if actual is not None:
+            self.limiter.settle(self.estimated, int(actual))
+
+
+@contextmanager
+def slot(kind: str, tokens: int, level: Optional[int] = None) -> Iterator[_Slot]:
+    """Wait for budget, run the block (one API call), and pause the kind if it answers 429."""
+    lim = limiter(kind)
+    tokens = max(0, int(tokens))
+    waited = lim.acquire(tokens, current_priority() if level is None else level)
+    if waited > 0.001:
+        metrics.incr(f"scheduler.{kind}.throttled")
+        metrics.incr(f"scheduler.{kind}.wait_seconds", round(waited, 3))
+    metrics.annotate(queued_ms=round(waited * 1000, 1))
+    try:
+        yield _Slot(lim, tokens)
+    except Exception as e:
+        if getattr(e, "status_code", None) == 429:
+            metrics.incr(f"scheduler.{kind}.rate_limited")
+            lim.pause(_retry_after(e))
+        raise
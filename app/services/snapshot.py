@@ -0,0 +1,131 @@
+"""Binary snapshot / restore of the vector store (no embedding API calls on restore).
+
+Layout of a snapshot directory:
+  manifest.json    count, dim, embedding model, creation time
+  embeddings.npy   float32 [count, dim], memory-mappable
+  rows.jsonl       {"id", "document", "metadata"} per line, same order as embeddings.npy
+  knn_graph.sqlite3, dedup.sqlite3, lexical.sqlite3   copies of the side indexes
+
+CLI (from the repository root):
+  python -m app.services.snapshot snapshot app/data/snapshots/latest
+  python -m app.services.snapshot restore app/data/snapshots/latest
+"""
+from typing import Dict, Optional
+from datetime import datetime
+import argparse
+import json
+import os
+import numpy as np
+from . import dedup, knn_index, lexical_index
+from . import vector_store
+from .embeddings import EMBED_MAX_TOKENS, embed_model
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot(out_dir: str, page_size: int = vector_store.PAGE_SIZE) -> Dict:
+    """Write the whole collection to `out_dir` page by page; returns the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    total = vector_store.get_count()
+    first = next(vector_store.iter_items(page_size=1, include_embeddings=True), None)
+    dim = len(first["embedding"]) if first else 0
+    emb_path = os.path.join(out_dir, "embeddings.npy")
+    mat = np.lib.format.open_memmap(emb_path, mode="w+", dtype=np.float32, shape=(total, dim))
+    n = 0
+    with open(os.path.join(out_dir, "rows.jsonl"), "w", encoding="utf-8") as fp:
+        for item in vector_store.iter_items(page_size=page_size, include_embeddings=True):
+            if n >= total:
+                break  # rows added while snapshotting are left for the next snapshot
+            mat[n] = item["embedding"]
+            fp.write(json.dumps({"id": item["id"], "document": item["text"], "metadata": item["meta"]}, ensure_ascii=False) + "\n")
+            n += 1
+    mat.flush()
+    del mat
+    knn_index.backup(os.path.join(out_dir, "knn_graph.sqlite3"))
+    dedup.backup(os.path.join(out_dir, "dedup.sqlite3"))
+    lexical_index.backup(os.path.join(out_dir, "lexical.sqlite3"))
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "count": n,
+        "dim": dim,
+        "embed_model": embed_model(),
+        "embed_max_tokens": EMBED_MAX_TOKENS,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def restore(in_dir: str, batch_size: Optional[int] = None, replace: bool = False) -> int:
+    """Bulk-load a snapshot into the current collection; returns the number of rows written.
+
+    Into an empty collection (or with `replace`) the kNN, keyword and dedup indexes are
+    restored from the snapshot's files. Merged into existing rows, neighbours and keywords
+    are indexed as rows are written and dedup entries are added, so the indexes cover old
+    and restored rows.
+    """
+    with open(os.path.join(in_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("embed_model") != embed_model():
+        raise ValueError(
+            f"Snapshot was embedded with {manifest.get('embed_model')!r}, current model is {embed_model()!r}"
+        )
+    if replace:
+        vector_store.delete_all()
+    merge = vector_store.get_count() > 0
+    count = int(manifest["count"])
+    mat = np.load(os.path.join(in_dir, "embeddings.npy"), mmap_mode="r")
+    step = max(1, min(int(batch_size or vector_store.max_batch_size()), vector_store.max_batch_size()))
+    # Into an empty store the kNN graph and keyword index are restored as files, so rows are
+    # written without recomputing them (the overview index is updated per row either way)
+    has_graph = not merge and os.path.exists(os.path.join(in_dir, "knn_graph.sqlite3"))
+    has_lexical = not merge and os.path.exists(os.path.join(in_dir, "lexical.sqlite3"))
+    flags = {"index_neighbors": not has_graph, "index_lexical": not has_lexical}
+    n = 0
+    with open(os.path.join(in_dir, "rows.jsonl"), "r", encoding="utf-8") as fp:
+        ids, docs, metas = [], [], []
+        for line in fp:
+            if n + len(ids) >= count:
+                break
+            row = json.loads(line)
+            ids.append(row["id"])
+            docs.append(row.get("document") or "")
+            metas.append(row.get("metadata") or {})
+            if len(ids) >= step:
+                vector_store.upsert_embedded(ids, docs, metas, mat[n : n + len(ids)].tolist(), **flags)
+                n += len(ids)
+                ids, docs, metas = [], [], []
+        if ids:
+            vector_store.upsert_embedded(ids, docs, metas, mat[n : n + len(ids)].tolist(), **flags)
+            n += len(ids)
+    if has_graph:
+        knn_index.restore_from(os.path.join(in_dir, "knn_graph.sqlite3"))
+    if has_lexical:
+        lexical_index.restore_from(os.path.join(in_dir, "lexical.sqlite3"))
+    if merge:
+        dedup.merge_from(os.path.join(in_dir, "dedup.sqlite3"))
+    else:
+        dedup.restore_from(os.path.join(in_dir, "dedup.sqlite3"))
+    return n
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Snapshot / restore the Chroma 'notes' collection")
+    ap.add_argument("command", choices=["snapshot", "restore"])
+    ap.add_argument("path", help="snapshot directory")
+    ap.add_argument("--persist-dir", default="app/data/chroma")
+    ap.add_argument("--batch-size", type=int, default=None)
+    ap.add_argument("--replace", action="store_true", help="delete existing rows before restoring")
+    args = ap.parse_args()
+    vector_store.init_store(args.persist_dir)
+    if args.command == "snapshot":
+        m = snapshot(args.path, page_size=args.batch_size or vector_store.PAGE_SIZE)
+        print(f"snapshot: {m['count']} rows (dim={m['dim']}) -> {args.path}")
+    else:
+        n = restore(args.path, batch_size=args.batch_size, replace=args.replace)
+        print(f"restore: {n} rows <- {args.path}")
+
+
+if __name__ == "__main__":
+    main()
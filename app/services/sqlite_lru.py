@@ -0,0 +1,123 @@
+"""Bounded on-disk key/value store with least-recently-used eviction (one SQLite table).
+
+Shared by the embedding and LLM response caches; each passes its table, value column and
+codec. Eviction is amortised: the entry count is tracked in memory and the table is only
+trimmed back to `max_entries` once it has grown `EVICT_SLACK` past it, instead of running
+COUNT(*) on every write.
+"""
+from typing import Any, Callable, Dict, List, Optional
+import os
+import sqlite3
+import threading
+import time
+
+# Fraction over max_entries tolerated before a trim
+EVICT_SLACK = float(os.getenv("CACHE_EVICT_SLACK", "0.05"))
+
+
+class LRUStore:
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        max_entries: int,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+        column: str = "value",
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.table = table
+        self.column = column
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._encode = encode
+        self._decode = decode
+        self._conn: Optional[sqlite3.Connection] = None
+        # Upper bound on the row count (replaced keys are counted as new until the next trim)
+        self._entries = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table}"
+                f" (key TEXT PRIMARY KEY, {self.column} BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table}(last_used)")
+            conn.commit()
+            self._entries = int(conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0])
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Decoded values for the given keys that are cached; bumps their LRU timestamp."""
+        if not self.enabled or not keys:
+            return {}
+        uniq = list(dict.fromkeys(keys))
+        raw: Dict[str, Any] = {}
+        with self._lock:
+            conn = self._get_conn()
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(uniq), 500):
+                part = uniq[start : start + 500]
+                marks = ",".join("?" * len(part))
+                raw.update(conn.execute(f"SELECT key, {self.column} FROM {self.table} WHERE key IN ({marks})", part))
+            if raw:
+                now = time.time()
+                conn.executemany(f"UPDATE {self.table} SET last_used=? WHERE key=?", [(now, k) for k in raw])
+                conn.commit()
+            self._stats["hits"] += sum(1 for k in keys if k in raw)
+            self._stats["misses"] += sum(1 for k in keys if k not in raw)
+        return {k: self._decode(v) for k, v in raw.items()}
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        """Store encoded values, trimming least recently used rows once over the size bound."""
+        if not self.enabled or not items:
+            return
+        rows = [(k, self._encode(v), time.time()) for k, v in items.items()]
+        with self._lock:
+            conn = self._get_conn()
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, {self.column}, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._stats["writes"] += len(rows)
+            self._entries += len(rows)
+            if self._entries > self.max_entries * (1.0 + EVICT_SLACK):
+                self._trim(conn)
+            conn.commit()
+
+    def _trim(self, conn: sqlite3.Connection) -> None:
+        total = int(conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0])
+        excess = total - self.max_entries
+        if excess > 0:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN"
+                f" (SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self._stats["evictions"] += excess
+        self._entries = min(total, self.max_entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/write/eviction counters plus the current entry count."""
+        out = dict(self._stats)
+        if self.enabled:
+            with self._lock:
+                out["entries"] = int(self._get_conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0])
+        else:
+            out["entries"] = 0
+        return out
+
+    def clear(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+            self._entries = 0
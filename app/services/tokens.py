@@ -0,0 +1,145 @@
+"""Token accounting shared by embedding, chunking, context selection and chat calls.
+
+- One tiktoken encoder per process (a failed load is remembered too, so an offline machine
+  doesn't retry the download on every call).
+- `truncate(..., exact=False)` skips encoding when the UTF-8 byte length already fits:
+  a byte-level BPE token covers at least one byte, so bytes are an upper bound on tokens.
+- Without an encoder, counts and cuts use a per-script estimate (CJK characters are
+  roughly one token each, ASCII about four characters per token) instead of a flat
+  characters-per-token ratio.
+- `record` feeds token totals and estimated cost into `metrics`, per request and overall.
+"""
+from typing import List, Optional, Tuple
+import logging
+import os
+import threading
+import numpy as np
+from . import metrics
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+# Truncation encodes only a prefix of this many characters per allowed token (the whole text if shorter)
+TRUNCATE_CHARS_PER_TOKEN = 6
+# USD per million tokens, for the cost counters (defaults: text-embedding-3-small, gpt-4o-mini)
+PRICES_PER_MTOK = {
+    "embeddings": (float(os.getenv("EMBED_PRICE_PER_MTOK", "0.02")), 0.0),
+    "chat": (float(os.getenv("CHAT_PRICE_IN_PER_MTOK", "0.15")), float(os.getenv("CHAT_PRICE_OUT_PER_MTOK", "0.60"))),
+}
+
+_log = logging.getLogger(__name__)
+_lock = threading.Lock()
+_encoder = None
+_loaded = False
+
+# Estimated tokens per character by code point range (rough averages for cl100k_base)
+_ASCII = 0.25
+_RANGES = (
+    # (first, last, tokens per char)
+    (0x3000, 0x303F, 1.0),   # CJK punctuation
+    (0x3040, 0x30FF, 0.8),   # hiragana, katakana
+    (0x3400, 0x9FFF, 1.2),   # CJK ideographs
+    (0xAC00, 0xD7AF, 1.0),   # hangul
+    (0xF900, 0xFAFF, 1.2),   # CJK compatibility ideographs
+    (0xFF00, 0xFFEF, 1.0),   # fullwidth forms
+)
+_OTHER = 0.5
+
+
+def encoder():
+    """The shared tiktoken encoding, or None if it can't be loaded (then estimates are used)."""
+    global _encoder, _loaded
+    if _loaded:
+        return _encoder
+    with _lock:
+        if not _loaded:
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                _log.warning("tokenizer %s unavailable, using estimates: %s", TOKEN_ENCODING, e)
+                _encoder = None
+            _loaded = True
+    return _encoder
+
+
+def upper_bound(text: str) -> int:
+    """Never fewer than the real token count (UTF-8 bytes)."""
+    return len(text.encode("utf-8", errors="ignore")) if text else 0
+
+
+def _char_weights(text: str) -> np.ndarray:
+    cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    w = np.full(cps.shape, _OTHER, dtype=np.float32)
+    w[cps < 0x80] = _ASCII
+    for lo, hi, v in _RANGES:
+        w[(cps >= lo) & (cps <= hi)] = v
+    return w
+
+
+def estimate_offsets(text: str) -> np.ndarray:
+    """Cumulative estimated tokens after each character (for estimate-based windows and cuts)."""
+    return np.cumsum(_char_weights(text)) if text else np.zeros(0, dtype=np.float32)
+
+
+def estimate(text: str) -> int:
+    """Token estimate without an encoder, by script (no upper-bound guarantee)."""
+    if not text:
+        return 0
+    return max(1, int(np.ceil(float(_char_weights(text).sum()))))
+
+
+def count(text: str, exact: bool = True) -> int:
+    """Token count: exact with the encoder (if `exact` and available), otherwise estimated."""
+    if not text:
+        return 0
+    enc = encoder() if exact else None
+    return len(enc.encode_ordinary(text)) if enc is not None else estimate(text)
+
+
+def count_many(texts: List[str], exact: bool = True) -> List[int]:
+    """Token counts of many texts; exact counts are encoded in one multi-threaded batch."""
+    enc = encoder() if exact else None
+    if enc is None:
+        return [estimate(t or "") for t in texts]
+    return [len(toks) for toks in enc.encode_ordinary_batch([t or "" for t in texts])]
+
+
+def truncate(text: str, max_tokens: int, exact: bool = True) -> Tuple[str, int]:
+    """Cut `text` to at most `max_tokens` tokens; returns it with its token count.
+
+    Text whose byte length fits is returned unchanged without encoding; its count is then
+    exact only if `exact` (which encodes it). Longer text is cut on token boundaries, or by
+    the per-script estimate when no encoder is available.
+    """
+    if not text:
+        return "", 0
+    max_tokens = max(0, int(max_tokens))
+    if upper_bound(text) <= max_tokens:
+        return text, count(text, exact)
+    enc = encoder()
+    if enc is None:
+        cum = estimate_offsets(text)
+        cut = int(np.searchsorted(cum, max_tokens, side="right"))
+        return text[:cut], int(np.ceil(float(cum[cut - 1]))) if cut else 0
+    # Tokens never span more than a few characters in practice, so a prefix usually suffices;
+    # it must hold more than max_tokens tokens so the boundary token is not an artefact of the cut
+    prefix = text[: max_tokens * TRUNCATE_CHARS_PER_TOKEN + 1]
+    toks = enc.encode_ordinary(prefix)
+    if len(prefix) < len(text) and len(toks) <= max_tokens + 1:
+        toks = enc.encode_ordinary(text)
+    if len(toks) <= max_tokens:
+        return text, len(toks)
+    # decode_bytes + ignore: a cut inside a multi-byte character drops it instead of adding U+FFFD
+    return enc.decode_bytes(toks[:max_tokens]).decode("utf-8", errors="ignore"), max_tokens
+
+
+def record(kind: str, prompt_tokens: Optional[int], completion_tokens: Optional[int] = 0) -> None:
+    """Add one API call's token usage and estimated cost to the counters and its request span."""
+    p, c = int(prompt_tokens or 0), int(completion_tokens or 0)
+    if not p and not c:
+        return
+    price_in, price_out = PRICES_PER_MTOK.get(kind, (0.0, 0.0))
+    cost = (p * price_in + c * price_out) / 1e6
+    metrics.incr(f"tokens.{kind}.prompt", p)
+    metrics.incr(f"tokens.{kind}.completion", c)
+    metrics.incr("cost.usd", cost)
+    metrics.accumulate(tokens=p + c, cost_usd=cost)
@@ -1,44 +1,327 @@
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict
-from .embeddings import get_embedding
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import numpy as np
+from .embeddings import PROVIDERS, embed_provider, get_embedding, get_embeddings
+from .chunking import pool_chunks, parent_of
+from . import knn_index
+from . import dedup
+from . import lexical_index
+from . import overview as overview_index
+from . import layout as node_layout
+from . import metrics
 
 _client = None
 _collection = None
+_persist_dir = None
+_init_lock = threading.Lock()
+# Bumped on every write/delete; cached search results from older generations are discarded
+_generation = 0
+_search_cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+_search_lock = threading.Lock()
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "128"))
 
+# Number of items embedded and written to Chroma per upsert call
+UPSERT_BATCH_SIZE = int(os.getenv("CHROMA_UPSERT_BATCH", "512"))
+# Chunks fetched per requested document, so several chunks of one note don't crowd out others
+SEARCH_OVERSAMPLE = int(os.getenv("SEARCH_OVERSAMPLE", "4"))
+# "hybrid": vector + BM25 fused by reciprocal rank, "vector": embeddings only, "lexical": BM25 only (no API call)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+_log = logging.getLogger(__name__)
+_lexical_warned = False
+
+
+def init_store(persist_dir: str = "app/data/chroma", check_space: bool = True):
+    """Open the shared client/collection once per process; later calls are no-ops.
+
+    `check_space=False` opens a collection embedded with another model (only `reindex` needs that).
+    """
+    global _client, _collection, _persist_dir
+    with _init_lock:
+        if _collection is not None and _persist_dir == persist_dir:
+            return _collection
+        # PersistentClient actually writes to disk; Client(Settings(persist_directory=...)) is in-memory in 0.5.x
+        _client = chromadb.PersistentClient(path=persist_dir, settings=Settings(anonymized_telemetry=False))
+        _collection = _client.get_or_create_collection(name="notes")
+        _persist_dir = persist_dir
+        if check_space:
+            _check_embedding_space()
+        knn_index.open_index(persist_dir)
+        dedup.open_index(persist_dir)
+        lexical_index.open_index(persist_dir)
+        overview_index.open_index(persist_dir)
+        _bump_generation()
+        return _collection
+
+
+def _check_embedding_space() -> None:
+    """Stamp the collection with the embedding provider/model; refuse to mix vector spaces.
+
+    An empty collection is recreated for the configured provider. A non-empty one must
+    match it (collections created before stamping are assumed to be OpenAI embeddings).
+    """
+    global _collection
+    provider = embed_provider()
+    want = {"embed_provider": provider.name, "embed_model": provider.model()}
+    meta = dict(_collection.metadata or {})
+    if all(meta.get(k) == v for k, v in want.items()):
+        return
+    if get_count() > 0:
+        have = meta.get("embed_model") or PROVIDERS["openai"].model()
+        if have != want["embed_model"]:
+            raise ValueError(
+                f"Collection 'notes' holds {have!r} embeddings but EMBED_PROVIDER={provider.name!r} uses "
+                f"{want['embed_model']!r}; run `python -m app.cli reindex` or switch the provider back"
+            )
+        _collection.modify(metadata={**meta, **want})
+        return
+    # Chroma keeps an emptied collection's dimension, so a new vector space needs a new collection
+    keep = {k: v for k, v in meta.items() if not k.startswith("embed_")}
+    _client.delete_collection("notes")
+    _collection = _client.get_or_create_collection(name="notes", metadata={**keep, **want})
+
+
+def _check_dim(embeddings: List[List[float]]) -> None:
+    dim = len(embeddings[0])
+    meta = dict(_collection.metadata or {})
+    if meta.get("embed_dim") is None:
+        _collection.modify(metadata={**meta, "embed_dim": dim})
+    elif int(meta["embed_dim"]) != dim:
+        raise ValueError(f"Embedding dimension {dim} does not match the collection ({meta['embed_dim']})")
+
+
+def get_generation() -> int:
+    return _generation
+
+
+def _bump_generation() -> None:
+    global _generation
+    _generation += 1
+    with _search_lock:
+        _search_cache.clear()
 
-def init_store(persist_dir: str = "app/data/chroma"):
-    global _client, _collection
-    _client = chromadb.Client(Settings(persist_directory=persist_dir))
-    _collection = _client.get_or_create_collection(name="notes")
 
+def _cached(key: tuple) -> Optional[List[Dict]]:
+    """A copy of the cached rows for `key` (marking it recently used), or None."""
+    with _search_lock:
+        out = _search_cache.get(key)
+        if out is None:
+            return None
+        _search_cache.move_to_end(key)
+        return list(out)
 
-def upsert_texts(items: List[Dict]):
-    embeddings = [get_embedding(x["text"]) for x in items]
-    _collection.upsert(
-        ids=[x["id"] for x in items],
-        documents=[x["text"] for x in items],
-        metadatas=[x.get("meta", {}) for x in items],
-        embeddings=embeddings,
-    )
+
+def _cache(key: tuple, out: List[Dict]) -> None:
+    with _search_lock:
+        _search_cache[key] = out
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+
+
+def _dist_to_sim(d: float) -> float:
+    # Embeddings are unit length and Chroma's default space is squared L2: d = 2 - 2cos
+    return 1.0 - float(d) / 2.0
+
+
+def _index_neighbors(ids: List[str], embeddings: List[List[float]], k: int = knn_index.KNN_INDEX_K):
+    """Look up the nearest stored rows for freshly written rows and record them in the kNN graph."""
+    total = get_count()
+    if total < 2 or not ids:
+        return
+    res = _collection.query(query_embeddings=embeddings, n_results=min(total, k + 1), include=["distances"])
+    neighbors = {}
+    for src, nids, dists in zip(ids, res.get("ids", []), res.get("distances", [])):
+        neighbors[src] = [(nid, _dist_to_sim(d)) for nid, d in zip(nids, dists) if nid != src][:k]
+    knn_index.add(neighbors, k=k)
+
+
+def upsert_texts(items: List[Dict], batch_size: int = UPSERT_BATCH_SIZE):
+    step = max(1, int(batch_size))
+    for start in range(0, len(items), step):
+        chunk = items[start : start + step]
+        embeddings = get_embeddings([x["text"] for x in chunk])
+        upsert_embedded(
+            ids=[x["id"] for x in chunk],
+            documents=[x["text"] for x in chunk],
+            metadatas=[x.get("meta", {}) for x in chunk],
+            embeddings=embeddings,
+        )
+
+
+def upsert_embedded(
+    ids: List[str],
+    documents: List[str],
+    metadatas: List[Dict],
+    embeddings: List[List[float]],
+    index_neighbors: bool = True,
+    index_lexical: bool = True,
+) -> None:
+    """Write rows that already carry embeddings (no API calls), keeping the side indexes in sync.
+
+    `index_neighbors` / `index_lexical` may be off when those indexes are restored separately.
+    """
+    if not ids:
+        return
+    with metrics.span("store.upsert", rows=len(ids)):
+        _check_dim(embeddings)
+        # Re-upserted rows: the overview index needs their old vectors to undo their centroid pull
+        previous = None
+        known = overview_index.cluster_of(ids)
+        if known:
+            res = _collection.get(ids=list(known), include=["embeddings"])
+            previous = dict(zip(res.get("ids", []) or [], res.get("embeddings", []) or []))
+        with metrics.span("chroma.upsert"):
+            _collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        if index_lexical:
+            with metrics.span("lexical.add"):
+                lexical_index.add(ids, documents)
+        with metrics.span("overview.add"):
+            overview_index.add(ids, [parent_of(i, m or {}) for i, m in zip(ids, metadatas)], embeddings, previous)
+        if index_neighbors:
+            with metrics.span("knn.index"):
+                _index_neighbors(ids, embeddings)
+        _bump_generation()
+
+
+def max_batch_size() -> int:
+    """Largest number of rows Chroma accepts in one write."""
+    try:
+        return int(_client.get_max_batch_size())
+    except Exception:
+        return 5000
 
 
-def search(query: str, top_k: int = 10) -> List[Dict]:
+def _vector_rows(query: str, n_results: int) -> List[Dict]:
     qemb = get_embedding(query)
-    res = _collection.query(query_embeddings=[qemb], n_results=top_k)
-    out = []
+    with metrics.span("chroma.query", n_results=n_results):
+        res = _collection.query(query_embeddings=[qemb], n_results=n_results)
+    rows = []
     ids = res.get("ids", [[]])[0]
     docs = res.get("documents", [[]])[0]
     metas = res.get("metadatas", [[]])[0]
     distances = res.get("distances", [[]])[0] if "distances" in res else [None] * len(ids)
     for i in range(len(ids)):
-        out.append({
+        rows.append({
             "id": ids[i],
             "text": docs[i],
             "score": float(distances[i]) if distances[i] is not None else None,
             "meta": metas[i],
         })
-    return out
+    return rows
+
+
+def _lexical_rows(query: str, n_results: int) -> List[Dict]:
+    global _lexical_warned
+    if lexical_index.doc_count() == 0 and get_count() > 0:
+        # Rows stored before the lexical index existed: rebuilding here would stall this request
+        if not _lexical_warned:
+            _log.warning("keyword index is empty; searching vectors only until `python -m app.cli rebuild-index lexical`")
+            _lexical_warned = True
+        metrics.incr("lexical.missing_index")
+        return []
+    with metrics.span("lexical.search") as sp:
+        hits = lexical_index.search(query, n_results)
+        sp.set(hits=len(hits))
+    if not hits:
+        return []
+    res = _collection.get(ids=[h[0] for h in hits], include=["documents", "metadatas"])
+    found = {
+        _id: (doc, meta)
+        for _id, doc, meta in zip(res.get("ids", []) or [], res.get("documents", []) or [], res.get("metadatas", []) or [])
+    }
+    return [
+        {"id": _id, "text": found[_id][0], "score": None, "meta": found[_id][1] or {}}
+        for _id, _ in hits
+        if _id in found
+    ]
+
+
+def _fuse(ranked: List[List[Dict]]) -> List[Dict]:
+    """Reciprocal rank fusion of ranked row lists.
+
+    `score` is rewritten as a distance-like value, 2 - 2·(fused / best fused), so the best
+    row scores 0 and `pool_chunks` can treat it like a Chroma distance.
+    """
+    fused: Dict[str, float] = {}
+    rows: Dict[str, Dict] = {}
+    for lst in ranked:
+        for rank, r in enumerate(lst):
+            fused[r["id"]] = fused.get(r["id"], 0.0) + 1.0 / (RRF_K + rank + 1)
+            rows.setdefault(r["id"], r)
+    if not fused:
+        return []
+    best = max(fused.values())
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [{**rows[i], "score": 2.0 - 2.0 * fused[i] / best} for i in order]
+
+
+def search(query: str, top_k: int = 10, pooling: str = "max", mode: str = SEARCH_MODE) -> List[Dict]:
+    """Return up to `top_k` parent documents ranked by their best-matching chunks.
+
+    Each result is the best chunk of its document ({id, text, score, meta}) plus
+    `parent_id` and `hits` (number of matching chunks); see `chunking.pool_chunks`.
+    `mode` is "vector", "lexical" (BM25 only, no embedding call) or "hybrid" (both, fused
+    by reciprocal rank); outside "vector" mode `score` is a rank-derived distance.
+    Results are cached per (query, top_k, pooling, mode) until the store is next modified.
+    """
+    with metrics.request("search", mode=mode, top_k=int(top_k)) as sp:
+        key = (query, int(top_k), pooling, mode, _generation)
+        hit = _cached(key)
+        if hit is not None:
+            sp.set(cached=True)
+            return hit
+        n_results = max(1, int(top_k) * max(1, SEARCH_OVERSAMPLE))
+        if mode == "vector":
+            rows = _vector_rows(query, n_results)
+        elif mode == "lexical":
+            rows = _fuse([_lexical_rows(query, n_results)])
+        else:
+            rows = _fuse([_vector_rows(query, n_results), _lexical_rows(query, n_results)])
+        out = pool_chunks(rows, top_k, pooling=pooling)
+        sp.set(cached=False, results=len(out))
+        _cache(key, out)
+        return list(out)
+
+
+def overview(top_k: int = 10) -> List[Dict]:
+    """Representative documents spread across the corpus clusters; no embedding call.
+
+    Rows look like `search` results plus `cluster`; `score` is 2 - 2·(similarity to the
+    cluster centroid), i.e. a distance-like value. Used when the query is empty.
+    """
+    key = ("", int(top_k), "overview", _generation)
+    hit = _cached(key)
+    if hit is not None:
+        return hit
+    if overview_index.member_count() == 0 and get_count() > 0:
+        # Rows stored before the overview index existed
+        rebuild_overview_index()
+    picks = overview_index.representatives(int(top_k))
+    if not picks:
+        return []
+    res = _collection.get(ids=[p[0] for p in picks], include=["documents", "metadatas"])
+    found = {
+        _id: (doc, meta or {})
+        for _id, doc, meta in zip(res.get("ids", []) or [], res.get("documents", []) or [], res.get("metadatas", []) or [])
+    }
+    out = []
+    for rid, cluster, sim in picks:
+        if rid not in found:
+            continue
+        doc, meta = found[rid]
+        out.append({
+            "id": rid, "text": doc, "score": 2.0 - 2.0 * sim, "meta": meta,
+            "parent_id": parent_of(rid, meta), "hits": 1, "cluster": cluster,
+        })
+    _cache(key, out)
+    return list(out)
 
 
 # --- Helpers for inspecting DB state ---
@@ -108,33 +391,356 @@ def get_embeddings_by_ids(ids: List[str]) -> Dict[str, List[float]]:
     return out
 
 
+# --- Paginated access ---
+
+PAGE_SIZE = int(os.getenv("CHROMA_PAGE_SIZE", "1000"))
+
+
+def get_embedding_matrix(ids: List[str], batch_size: int = PAGE_SIZE) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Embeddings for `ids` as one contiguous float32 matrix plus {id: row}; unknown ids are absent.
+
+    Prefer this over `get_embeddings_by_ids` for math: rows are converted page by page, so
+    no per-document list of Python floats outlives the fetch.
+    """
+    with metrics.span("store.get_embeddings", ids=len(ids)) as sp:
+        X, index = _embedding_matrix(ids, batch_size)
+        sp.set(rows=len(index), bytes=int(X.nbytes))
+        return X, index
+
+
+def _embedding_matrix(ids: List[str], batch_size: int) -> Tuple[np.ndarray, Dict[str, int]]:
+    uniq = list(dict.fromkeys(ids))
+    index: Dict[str, int] = {}
+    if _collection is None or not uniq:
+        return np.zeros((0, 0), dtype=np.float32), index
+    X = None
+    step = max(1, int(batch_size))
+    for start in range(0, len(uniq), step):
+        res = _collection.get(ids=uniq[start : start + step], include=["embeddings"])
+        got = res.get("ids", []) or []
+        embs = res.get("embeddings")
+        if not got or embs is None or len(embs) == 0:
+            continue
+        page = np.asarray(embs, dtype=np.float32)
+        if X is None:
+            X = np.empty((len(uniq), page.shape[1]), dtype=np.float32)
+        n = len(index)
+        X[n : n + len(got)] = page
+        index.update((_id, n + i) for i, _id in enumerate(got))
+    if X is None:
+        return np.zeros((0, 0), dtype=np.float32), index
+    return X[: len(index)], index
+
+
+def get_chunks(parent_ids: List[str], page_size: int = PAGE_SIZE) -> Tuple[List[Dict], np.ndarray]:
+    """Every stored chunk of the given documents as {id, text, meta} rows plus a float32 matrix.
+
+    Rows stored before chunking have no `parent_id` and are matched by their own id.
+    """
+    parents = list(dict.fromkeys(parent_ids))
+    rows: List[Dict] = []
+    mats: List[np.ndarray] = []
+    if _collection is None or not parents:
+        return rows, np.zeros((0, 0), dtype=np.float32)
+    step = max(1, int(page_size))
+    for start in range(0, len(parents), step):
+        part = parents[start : start + step]
+        for res in iter_pages(page_size, include=("documents", "metadatas", "embeddings"), where={"parent_id": {"$in": part}}):
+            ids = res.get("ids", []) or []
+            rows.extend({"id": i, "text": d, "meta": m or {}} for i, d, m in zip(ids, res["documents"], res["metadatas"]))
+            mats.append(np.asarray(res["embeddings"], dtype=np.float32))
+    found = {r["meta"].get("parent_id") for r in rows}
+    legacy = [p for p in parents if p not in found]
+    if legacy:
+        res = _collection.get(ids=legacy, include=["documents", "metadatas", "embeddings"])
+        ids = res.get("ids", []) or []
+        if ids:
+            rows.extend({"id": i, "text": d, "meta": m or {}} for i, d, m in zip(ids, res["documents"], res["metadatas"]))
+            mats.append(np.asarray(res["embeddings"], dtype=np.float32))
+    if not mats:
+        return rows, np.zeros((0, 0), dtype=np.float32)
+    return rows, np.vstack(mats)
+
+
+def iter_pages(
+    page_size: int = PAGE_SIZE,
+    include: Tuple[str, ...] = ("documents", "metadatas"),
+    where: Optional[Dict] = None,
+) -> Iterator[Dict]:
+    """Yield raw `collection.get` pages ({ids, documents, metadatas, embeddings}) of at most `page_size` rows."""
+    if _collection is None:
+        return
+    step = max(1, int(page_size))
+    offset = 0
+    while True:
+        res = _collection.get(limit=step, offset=offset, where=where, include=list(include))
+        ids = res.get("ids", []) or []
+        if not ids:
+            return
+        yield res
+        if len(ids) < step:
+            return
+        offset += len(ids)
+
+
+def iter_items(
+    page_size: int = PAGE_SIZE,
+    include_embeddings: bool = False,
+    where: Optional[Dict] = None,
+) -> Iterator[Dict]:
+    """Yield {id, text, meta[, embedding]} rows one page at a time (constant memory)."""
+    include = ("documents", "metadatas", "embeddings") if include_embeddings else ("documents", "metadatas")
+    for res in iter_pages(page_size, include=include, where=where):
+        ids = res.get("ids", []) or []
+        docs = res.get("documents") or [""] * len(ids)
+        metas = res.get("metadatas") or [{}] * len(ids)
+        embs = res.get("embeddings") if include_embeddings else None
+        for i, _id in enumerate(ids):
+            item = {"id": _id, "text": docs[i], "meta": metas[i] or {}}
+            if embs is not None:
+                item["embedding"] = list(embs[i])
+            yield item
+
+
+def iter_ids(page_size: int = PAGE_SIZE, where: Optional[Dict] = None) -> Iterator[str]:
+    for res in iter_pages(page_size, include=(), where=where):
+        yield from res.get("ids", []) or []
+
+
+def export_jsonl(fp: IO[str], page_size: int = PAGE_SIZE, include_embeddings: bool = False) -> int:
+    """Stream every row to `fp` as JSON lines; returns the number of rows written."""
+    n = 0
+    for item in iter_items(page_size, include_embeddings=include_embeddings):
+        fp.write(json.dumps(item, ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+
 # --- Deletion helpers ---
 
-def delete_by_ids(ids: List[str]) -> int:
+def _delete_ids(ids: List[str]) -> None:
+    res = _collection.get(ids=ids, include=["metadatas"])
+    parents = [parent_of(i, m) for i, m in zip(res.get("ids", []) or [], res.get("metadatas", []) or [])]
+    _collection.delete(ids=ids)
+    knn_index.remove(ids)
+    lexical_index.remove(ids)
+    overview_index.remove(ids)
+    node_layout.forget(ids)
+    # A partially deleted document may be uploaded again
+    dedup.remove(parents)
+
+
+def delete_by_ids(ids: List[str], batch_size: int = PAGE_SIZE) -> int:
     """Delete items by their IDs. Returns the number of requested deletions."""
     if _collection is None or not ids:
         return 0
+    uniq = list(dict.fromkeys(ids))
+    step = max(1, int(batch_size))
     try:
         # Best-effort: Chroma delete doesn't return count
-        _collection.delete(ids=list(set(ids)))
-        return len(set(ids))
+        for start in range(0, len(uniq), step):
+            _delete_ids(uniq[start : start + step])
+        return len(uniq)
+    except Exception:
+        return 0
+    finally:
+        _bump_generation()
+
+
+def delete_where(where: Dict, batch_size: int = PAGE_SIZE) -> int:
+    """Delete rows matching a metadata filter in bounded batches. Returns the number deleted."""
+    if _collection is None or not where:
+        return 0
+    step = max(1, int(batch_size))
+    n = 0
+    try:
+        while True:
+            # Always read the first page: earlier pages are gone after each delete
+            ids = _collection.get(limit=step, where=where, include=[]).get("ids", []) or []
+            if not ids:
+                break
+            _delete_ids(ids)
+            n += len(ids)
+    except Exception:
+        pass
+    finally:
+        _bump_generation()
+    return n
+
+
+def delete_all(batch_size: int = PAGE_SIZE) -> int:
+    """Delete all items in the collection in bounded batches. Returns the number deleted."""
+    if _collection is None:
+        return 0
+    step = max(1, int(batch_size))
+    n = 0
+    try:
+        while True:
+            ids = _collection.get(limit=step, include=[]).get("ids", []) or []
+            if not ids:
+                break
+            _collection.delete(ids=ids)
+            n += len(ids)
+        knn_index.clear()
+        dedup.clear()
+        lexical_index.clear()
+        overview_index.clear()
+        node_layout.forget()
     except Exception:
+        pass
+    finally:
+        _bump_generation()
+    return n
+
+
+def rebuild_knn_index(batch_size: int = UPSERT_BATCH_SIZE) -> int:
+    """Recompute the kNN graph for every stored row (e.g. rows stored before the index existed)."""
+    if _collection is None:
         return 0
+    knn_index.clear()
+    done = 0
+    for res in iter_pages(batch_size, include=("embeddings",)):
+        ids = res.get("ids", []) or []
+        embs = [list(e) for e in (res.get("embeddings", []) or [])]
+        _index_neighbors(ids, embs)
+        done += len(ids)
+    return done
 
 
-def delete_all() -> int:
-    """Delete all items in the collection. Returns number of items attempted to delete."""
+def rebuild_lexical_index(batch_size: int = PAGE_SIZE) -> int:
+    """Re-index every stored row for keyword search."""
     if _collection is None:
         return 0
+    lexical_index.clear()
+    done = 0
+    for res in iter_pages(batch_size, include=("documents",)):
+        ids = res.get("ids", []) or []
+        lexical_index.add(ids, res.get("documents", []) or [""] * len(ids))
+        done += len(ids)
+    return done
+
+
+def rebuild_overview_index(batch_size: int = PAGE_SIZE) -> int:
+    """Re-cluster every stored row for the corpus overview."""
+    if _collection is None:
+        return 0
+    overview_index.clear()
+    done = 0
+    for res in iter_pages(batch_size, include=("embeddings", "metadatas")):
+        ids = res.get("ids", []) or []
+        metas = res.get("metadatas", []) or [{}] * len(ids)
+        overview_index.add(ids, [parent_of(i, m or {}) for i, m in zip(ids, metas)], res.get("embeddings"))
+        done += len(ids)
+    return done
+
+
+# --- Re-embedding ---
+
+REINDEX_COLLECTION = "notes__reindex"
+REINDEX_OLD_COLLECTION = "notes__old"
+
+
+def _read_json(path: str) -> Dict:
     try:
-        total = int(_collection.count())
-        if total == 0:
-            return 0
-        res = _collection.get(limit=total)
-        all_ids = res.get("ids", []) if isinstance(res.get("ids", []), list) else []
-        if not all_ids:
-            return 0
-        _collection.delete(ids=all_ids)
-        return len(all_ids)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception:
+        return {}
+
+
+def _write_json(path: str, data: Dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _swap_reindexed(state: Dict, checkpoint_path: str) -> None:
+    """Put the staging collection in place of "notes" (resumable: each step is checked)."""
+    global _collection
+    _write_json(checkpoint_path, {**state, "swapping": True})
+    names = {c.name for c in _client.list_collections()}
+    if REINDEX_COLLECTION in names:
+        if "notes" in names:
+            if REINDEX_OLD_COLLECTION in names:
+                # Interrupted after the rename: this "notes" is the empty one init_store created
+                _client.delete_collection("notes")
+            else:
+                _client.get_collection("notes").modify(name=REINDEX_OLD_COLLECTION)
+        _client.get_collection(REINDEX_COLLECTION).modify(name="notes")
+    if REINDEX_OLD_COLLECTION in {c.name for c in _client.list_collections()}:
+        _client.delete_collection(REINDEX_OLD_COLLECTION)
+    _collection = _client.get_or_create_collection(name="notes")
+    os.remove(checkpoint_path)
+    rebuild_knn_index()
+    rebuild_overview_index()
+    _bump_generation()
+
+
+def reindex(
+    batch_size: int = UPSERT_BATCH_SIZE,
+    checkpoint_path: Optional[str] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """Re-embed every stored row with the configured provider/model and swap the result in.
+
+    Rows are embedded into a staging collection page by page and the source offset is
+    checkpointed (default: reindex.json in the persist dir) after each page, so an
+    interrupted run resumes where it stopped. Search keeps the old vectors until the swap.
+    The kNN graph and overview clusters are rebuilt from the new vectors; the keyword and
+    dedup indexes are text-based and kept. Don't write to the store while this runs.
+    Returns the number of rows re-embedded by this call.
+    """
+    if _collection is None:
+        return 0
+    checkpoint_path = checkpoint_path or os.path.join(_persist_dir, "reindex.json")
+    provider = embed_provider()
+    want = {"embed_provider": provider.name, "embed_model": provider.model()}
+    state = _read_json(checkpoint_path)
+    if state.get("swapping"):
+        _swap_reindexed(state, checkpoint_path)
         return 0
+    names = {c.name for c in _client.list_collections()}
+    if state.get("embed_model") != want["embed_model"] and REINDEX_COLLECTION in names:
+        # A staging collection from another model (or without a checkpoint) can't be resumed
+        _client.delete_collection(REINDEX_COLLECTION)
+        names.discard(REINDEX_COLLECTION)
+        state = {}
+    keep = {k: v for k, v in (_collection.metadata or {}).items() if not k.startswith("embed_")}
+    offset = int(state.get("offset", 0)) if state else 0
+    if offset and REINDEX_COLLECTION in names:
+        staging = _client.get_collection(name=REINDEX_COLLECTION)
+        if staging.count() != offset:
+            # Staging doesn't hold exactly the checkpointed rows: resuming would leave gaps
+            _log.warning("reindex checkpoint at %d but staging has %d rows; starting over", offset, staging.count())
+            _client.delete_collection(REINDEX_COLLECTION)
+            offset = 0
+    elif offset:
+        _log.warning("reindex checkpoint at %d but the staging collection is gone; starting over", offset)
+        offset = 0
+    staging = _client.get_or_create_collection(name=REINDEX_COLLECTION, metadata={**keep, **want})
+    total = get_count()
+    state = {**want, "offset": offset, "total": total}
+    _write_json(checkpoint_path, state)
+    done = 0
+    step = max(1, min(int(batch_size), max_batch_size()))
+    while offset < total:
+        with metrics.span("store.reindex_page", offset=offset):
+            res = _collection.get(limit=step, offset=offset, include=["documents", "metadatas"])
+            ids = res.get("ids", []) or []
+            if not ids:
+                break
+            docs = res.get("documents") or [""] * len(ids)
+            metas = [m or {} for m in (res.get("metadatas") or [{}] * len(ids))]
+            embeddings = get_embeddings([d or "" for d in docs])
+            if not (staging.metadata or {}).get("embed_dim"):
+                staging.modify(metadata={**(staging.metadata or {}), "embed_dim": len(embeddings[0])})
+            staging.upsert(ids=ids, documents=docs, metadatas=metas, embeddings=embeddings)
+        offset += len(ids)
+        done += len(ids)
+        state["offset"] = offset
+        _write_json(checkpoint_path, state)
+        if on_progress:
+            on_progress(offset, total)
+    _swap_reindexed(state, checkpoint_path)
+    return done
@@ -1,16 +1,22 @@
 from dotenv import load_dotenv
 load_dotenv()  # .env ファイルを読み込む
 
-import streamlit as st, os, uuid, json
+import streamlit as st, os
+import io
 # Import Streamlit's rerun exception to avoid catching it as an error
 try:
     from streamlit.runtime.scriptrunner import RerunException  # type: ignore
 except Exception:  # Fallback for older/newer versions
     RerunException = None  # type: ignore
 
-from services.vector_store import init_store, upsert_texts, search, get_count, list_items, delete_by_ids, delete_all
+from services.vector_store import init_store, search, overview, get_count, list_items, delete_by_ids, delete_all, delete_where, export_jsonl
 from services.graph import build_graph
-from services.insights import generate_gaps_and_quiz
+from services.ingest import checkpoint_for, run_ingest
+from utils.text_clean import clean_text
+from services.embed_cache import stats as embed_cache_stats
+from services.insights import generate_sharded
+from services.context import build_context
+from services import metrics
 from datetime import datetime
 
 st.set_page_config(page_title="Knowledge Map Prototype", layout="wide")
@@ -20,24 +26,45 @@ DATA_RAW = "app/data/raw"
 EXPORT_DIR = "app/data/export"
 os.makedirs(DATA_RAW, exist_ok=True)
 os.makedirs(EXPORT_DIR, exist_ok=True)
-init_store()
+
+
+@st.cache_resource
+def _shared_store():
+    # One Chroma client/collection per process, shared by all sessions and reruns
+    if metrics.METRICS_PORT:
+        try:
+            metrics.serve(metrics.METRICS_PORT)
+        except OSError:
+            pass  # port taken (e.g. another worker): the in-app panel still works
+    return init_store()
+
+
+_shared_store()
 
 with st.sidebar:
     st.header("1) ノートをアップロード")
     files = st.file_uploader("txt/md形式推奨（pdfはテキスト抽出後のtxt）", type=["txt","md"], accept_multiple_files=True)
     if st.button("インデックス作成", type="primary") and files:
-        items = []
-        for f in files:
-            text = f.read().decode("utf-8", errors="ignore")
-            fid = f"{f.name}#{uuid.uuid4().hex[:8]}"
-            path = os.path.join(DATA_RAW, f"{fid}.txt")
-            with open(path, "w", encoding="utf-8") as out:
-                out.write(text)
-            items.append({"id": fid, "text": text, "meta": {"title": f.name, "source": path}})
-        with st.status("Embedding & 登録中...", expanded=True):
-            upsert_texts(items)
-            st.write(f"{len(items)} 件を登録しました。")
-        st.success("インデックス作成 完了")
+        with st.status("Embedding & 登録中...", expanded=True) as status:
+            progress = st.empty()
+
+            def _show(p):
+                progress.write(
+                    f"読込 {p['read']}/{len(files)}（スキップ {p['skipped']} / 重複 {p['duplicates']} / 類似版 {p['near_duplicates']}） / "
+                    f"チャンク {p['chunks']} / Embedding {p['embedded']} / 登録 {p['committed']}"
+                )
+
+            try:
+                stats = run_ingest(
+                    ((f.name, f.getvalue()) for f in files), DATA_RAW, clean=clean_text, on_progress=_show,
+                    checkpoint_path=checkpoint_for(f"{f.name}:{f.size}" for f in files),
+                )
+                _show(stats)
+                st.write(f"{stats['committed']} ファイル（{stats['embedded']} チャンク）を登録しました。")
+                status.update(label="インデックス作成 完了", state="complete")
+            except Exception as e:
+                status.update(label="インデックス作成 中断", state="error")
+                st.error(f"登録に失敗しました（登録済み分は保持され、再実行で続きから再開します）: {e}")
 
     # --- DB確認 ---
     st.divider()
@@ -45,9 +72,13 @@ with st.sidebar:
         try:
             cnt = get_count()
             st.metric("ドキュメント件数", cnt)
+            cs = embed_cache_stats()
+            st.caption(f"Embeddingキャッシュ: {cs['entries']} 件 / hit {cs['hits']} / miss {cs['misses']}")
             default_limit = 20 if cnt >= 20 else max(1, cnt) if cnt > 0 else 10
             limit = st.slider("表示件数 (最大50)", 1, 50, default_limit, key="db_limit")
-            items = list_items(limit)
+            pages = max(1, -(-cnt // limit))
+            page = st.number_input(f"ページ (1〜{pages})", min_value=1, max_value=pages, value=1, step=1, key="db_page")
+            items = list_items(limit, offset=(int(page) - 1) * limit)
             rows = []
             for it in items:
                 meta = it.get("meta", {}) or {}
@@ -87,29 +118,92 @@ with st.sidebar:
                         st.success(f"全削除を実行しました（{n} 件）。")
                         st.rerun()
 
-            payload = {"count": cnt, "items": rows}
-            st.download_button(
-                label="JSONをダウンロード",
-                data=json.dumps(payload, ensure_ascii=False, indent=2),
-                file_name="chroma_snapshot.json",
-                mime="application/json",
-                key="db_json_dl",
-            )
+            del_title = st.text_input("タイトル（ファイル名）で一括削除", "", key="db_del_title")
+            if st.button("このタイトルを削除", disabled=not del_title, key="db_del_title_btn"):
+                n = delete_where({"title": del_title})
+                st.success(f"{n} 件を削除しました。")
+                st.rerun()
+
+            # Export streams page by page into a file, then that file is offered for download
+            export_path = os.path.join(EXPORT_DIR, "chroma_snapshot.jsonl")
+            if st.button("全件をJSONLにエクスポート", key="db_export_btn"):
+                with open(export_path, "w", encoding="utf-8") as fp:
+                    n = export_jsonl(fp)
+                st.success(f"{n} 件を書き出しました: {export_path}")
+            if os.path.exists(export_path):
+                with open(export_path, "rb") as fp:
+                    st.download_button(
+                        label="JSONLをダウンロード",
+                        data=fp,
+                        file_name="chroma_snapshot.jsonl",
+                        mime="application/x-ndjson",
+                        key="db_json_dl",
+                    )
         except Exception as e:
             # Allow Streamlit's rerun exception to bubble up, otherwise it shows as an error
             if (getattr(e, "rerun_data", None) is not None) or ("RerunData" in str(e)) or (RerunException and isinstance(e, RerunException)):
                 raise
             st.error(f"DB確認でエラー: {e}")
 
+    # --- 診断 ---
+    with st.expander("診断（メトリクス）", expanded=False):
+        if not metrics.METRICS_ENABLED:
+            st.caption("METRICS_ENABLED=0 のため計測は無効です。")
+        st.caption("処理段階ごとの所要時間（直近の p50 / p95 / 最大）")
+        st.dataframe(metrics.summary(), hide_index=True, use_container_width=True)
+        cnt_rows = [{"counter": k, "value": v} for k, v in metrics.counters().items()]
+        if cnt_rows:
+            st.dataframe(cnt_rows, hide_index=True, use_container_width=True)
+        recent_reqs = metrics.recent(10)
+        if recent_reqs:
+            st.caption("直近のリクエスト（段階の内訳つき）")
+            st.json(recent_reqs, expanded=False)
+        if metrics.METRICS_PORT:
+            st.caption(f"Prometheus: http://127.0.0.1:{metrics.METRICS_PORT}/metrics")
+        # Built in memory and only on request: the panel re-runs with every interaction of every session
+        if st.button("エクスポートを作成", key="metrics_export_btn"):
+            buf = io.StringIO()
+            metrics.export_jsonl(buf)
+            st.session_state["metrics_export"] = (metrics.prometheus_text(), buf.getvalue())
+        if "metrics_export" in st.session_state:
+            prom, jsonl = st.session_state["metrics_export"]
+            m1, m2 = st.columns(2)
+            with m1:
+                st.download_button(
+                    label="Prometheus形式",
+                    data=prom,
+                    file_name="metrics.prom",
+                    mime="text/plain",
+                    key="metrics_prom_dl",
+                )
+            with m2:
+                st.download_button(
+                    label="JSONL",
+                    data=jsonl,
+                    file_name="metrics.jsonl",
+                    mime="application/x-ndjson",
+                    key="metrics_jsonl_dl",
+                )
+        if st.button("計測をリセット", key="metrics_reset_btn"):
+            metrics.reset()
+            st.session_state.pop("metrics_export", None)
+            st.rerun()
+
 st.header("2) 検索 & マップ")
-q = st.text_input("検索クエリ（空でもOK: 全体から一部を可視化）", "")
+q = st.text_input("検索クエリ（空でもOK: 各クラスタの代表ノートで全体像を表示）", "")
 topk = st.slider("取得件数", 5, 50, 15)
+SEARCH_MODES = {"hybrid": "ハイブリッド（キーワード＋ベクトル）", "vector": "ベクトルのみ", "lexical": "キーワードのみ（API不要・高速）"}
+search_mode = st.radio("検索方式", list(SEARCH_MODES.keys()), format_func=SEARCH_MODES.get, horizontal=True)
+whole_corpus = st.checkbox("コーパス全体をマップ（kNNインデックス使用）", value=False)
+focus = st.number_input("クラスタを展開（#番号、-1 で全体）", min_value=-1, value=-1, step=1)
 
 if st.button("マップ作成"):
-    results = search(q or "overview", topk)
-    html_path = build_graph(results)
-    with open(html_path, "r", encoding="utf-8") as f:
-        st.components.v1.html(f.read(), height=620, scrolling=True)
+    if whole_corpus:
+        results = list_items(int(os.getenv("CORPUS_MAP_LIMIT", "2000")))
+    else:
+        results = search(q, topk, mode=search_mode) if q else overview(topk)
+    html = build_graph(results, use_index=whole_corpus, focus_cluster=None if focus < 0 else int(focus))
+    st.components.v1.html(html, height=620, scrolling=True)
     st.session_state["last_results"] = results
     st.success("マップ生成 完了")
 
@@ -117,11 +211,25 @@ st.header("3) 不足の指摘 & クイズ生成")
 summary = st.text_area("要約（任意）", "これまでの学習の要点...")
 quiz_n = st.slider("クイズ数", 1, 20, 3)
 if st.button("不足/クイズ 生成", type="secondary"):
-    results = st.session_state.get("last_results", search(q or "overview", 10))
-    snippets = [r["text"][:800] for r in results]
-    data = generate_gaps_and_quiz(summary, snippets, quiz_n=quiz_n)
+    results = st.session_state.get("last_results") or (search(q, 10, mode=search_mode) if q else overview(10))
+    # 関連度と多様性（MMR）でチャンクを選び、トークン予算内に収める
+    ctx = build_context(results, query=f"{q}\n{summary}".strip())
+    # トピック（クラスタ）ごとに並列生成し、終わったシャードから順に表示する
+    live = st.empty()
+
+    def _partial(part, done, total):
+        lines = [f"生成中… {done}/{total}"]
+        lines += [f"- Q{i}. {qz.get('question', '')}" for i, qz in enumerate(part.get("quiz", []), 1)]
+        live.markdown("\n".join(lines))
+
+    data = generate_sharded(summary, ctx["snippets"], quiz_n=quiz_n, sources=ctx["sources"], on_progress=_partial)
+    live.empty()
     # デバッグ表示（件数と生出力/JSON）
-    st.caption(f"不足: {len(data.get('gaps', []))}件 / クイズ: {len(data.get('quiz', []))}問")
+    st.caption(
+        f"不足: {len(data.get('gaps', []))}件 / クイズ: {len(data.get('quiz', []))}問 / "
+        f"参照チャンク: {len(ctx['sources'])}件（{ctx['tokens']} tokens） / "
+        f"シャード: {data['_usage']['shards']}（キャッシュ {data['_usage']['cached']}）"
+    )
     with st.expander("LLM生出力（デバッグ）", expanded=False):
         st.text(data.get("_raw", ""))
     with st.expander("生成JSON（デバッグ）", expanded=False):
@@ -159,7 +267,7 @@ if st.button("不足/クイズ 生成", type="secondary"):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M")
     md_lines.append(f"# 学習支援レポート ({ts})")
     md_lines.append("")
-    md_lines.append(f"- 検索クエリ: {q or 'overview'}")
+    md_lines.append(f"- 検索クエリ: {q or '（全体像: クラスタ代表）'}")
     md_lines.append(f"- 取得件数: {len(results)}")
     md_lines.append("")
     md_lines.append("## 要約")
@@ -198,11 +306,9 @@ if st.button("不足/クイズ 生成", type="secondary"):
         md_lines.append("")
 
     md_lines.append("## 参考ノート")
-    for r in results:
-        title = r.get("meta", {}).get("title", r.get("id", ""))
-        source = r.get("meta", {}).get("source", "")
-        suffix = f" ({source})" if source else ""
-        md_lines.append(f"- {title}{suffix}")
+    for src in ctx["sources"]:
+        suffix = f" ({src['source']})" if src["source"] else ""
+        md_lines.append(f"- [{src['n']}] {src['title']}{suffix}")
 
     md_content = "\n".join(md_lines)
     default_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
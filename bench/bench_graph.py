@@ -0,0 +1,143 @@
+"""Benchmark: pure-Python vs NumPy similarity + mutual-kNN edges in services/graph.py.
+
+Usage: python bench/bench_graph.py [--sizes 15 50 500 5000] [--dim 1536]
+Each corpus is written to a throwaway store (no embedding calls), and the NumPy side times
+what build_graph runs: the float32 matrix read from the store, similarities and edges.
+The pure-Python reference is timed up to --legacy-max-n and extrapolated (O(n^2)) above it.
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services import vector_store  # noqa: E402
+from services.graph import _aligned_matrix, _build_mutual_knn_edges, _sims_from_matrix  # noqa: E402
+
+
+# --- Reference implementation (pre-NumPy graph.py) ---
+
+def _legacy_cosine_sim(u: List[float], v: List[float]) -> float:
+    if not u or not v or len(u) != len(v):
+        return 0.0
+    dot = nu = nv = 0.0
+    for a, b in zip(u, v):
+        dot += a * b
+        nu += a * a
+        nv += b * b
+    if nu <= 0 or nv <= 0:
+        return 0.0
+    return dot / (math.sqrt(nu) * math.sqrt(nv))
+
+
+def _legacy_pairwise_sims(ids: List[str], embs: Dict[str, List[float]]) -> Dict[Tuple[int, int], float]:
+    sims: Dict[Tuple[int, int], float] = {}
+    for i in range(len(ids)):
+        for j in range(i + 1, len(ids)):
+            sims[(i, j)] = _legacy_cosine_sim(embs[ids[i]], embs[ids[j]])
+    return sims
+
+
+def _legacy_mutual_knn_edges(ids: List[str], sims: Dict[Tuple[int, int], float], k: int, thr: float):
+    n = len(ids)
+    nbrs: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+    for (i, j), s in sims.items():
+        if s >= thr:
+            nbrs[i].append((j, s))
+            nbrs[j].append((i, s))
+    for i in range(n):
+        nbrs[i].sort(key=lambda x: x[1], reverse=True)
+        if k > 0:
+            del nbrs[i][k:]
+    edges = []
+    for i in range(n):
+        for j, s in nbrs[i]:
+            if i in {ii for ii, _ in nbrs[j]}:
+                a, b = ids[i], ids[j]
+                if a < b:
+                    edges.append((a, b, s))
+    return edges
+
+
+def _corpus(n: int, dim: int, seed: int = 0) -> Tuple[List[str], Dict[str, List[float]]]:
+    """Clustered random vectors so that thresholds produce a realistic number of edges."""
+    rnd = random.Random(seed)
+    centers = [[rnd.gauss(0, 1) for _ in range(dim)] for _ in range(max(2, n // 10))]
+    ids = [f"doc{i:05d}" for i in range(n)]
+    embs = {}
+    for _id in ids:
+        c = rnd.choice(centers)
+        embs[_id] = [x + rnd.gauss(0, 0.6) for x in c]
+    return ids, embs
+
+
+def _load(persist_dir: str, ids: List[str], embs: Dict[str, List[float]]) -> None:
+    vector_store.init_store(persist_dir, check_space=False)
+    step = vector_store.max_batch_size()
+    for start in range(0, len(ids), step):
+        part = ids[start : start + step]
+        vector_store.upsert_embedded(part, part, [{"title": i} for i in part], [embs[i] for i in part], index_neighbors=False)
+
+
+def _same_edges(edges, ledges) -> bool:
+    """Same edge set, similarities equal up to float32 vs float64 rounding."""
+    new = {(a, b): s for a, b, s in edges}
+    old = {(a, b): s for a, b, s in ledges}
+    if new.keys() != old.keys():
+        return False
+    keys = sorted(new)
+    return bool(np.isclose([new[k] for k in keys], [old[k] for k in keys], atol=1e-4).all())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[15, 50, 500, 5000])
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--knn", type=int, default=5)
+    ap.add_argument("--thr", type=float, default=0.75)
+    ap.add_argument("--legacy-max-n", type=int, default=500)
+    args = ap.parse_args()
+
+    print(f"{'n':>6} {'legacy_s':>12} {'numpy_s':>10} {'speedup':>9}  match")
+    last_legacy = None  # (n, seconds) of the largest measured legacy run
+    work = tempfile.mkdtemp(prefix="kmap-bench-graph-")
+    try:
+        for i, n in enumerate(args.sizes):
+            ids, embs = _corpus(n, args.dim)
+            _load(os.path.join(work, f"chroma_{i}_{n}"), ids, embs)
+
+            t0 = time.perf_counter()
+            X, valid = _aligned_matrix(ids)
+            sims = _sims_from_matrix(X, valid)
+            edges = _build_mutual_knn_edges(ids, sims, k=args.knn, thr=args.thr)
+            t_np = time.perf_counter() - t0
+
+            match = "-"
+            if n <= args.legacy_max_n:
+                t0 = time.perf_counter()
+                lsims = _legacy_pairwise_sims(ids, embs)
+                ledges = _legacy_mutual_knn_edges(ids, lsims, k=args.knn, thr=args.thr)
+                t_legacy = time.perf_counter() - t0
+                last_legacy = (n, t_legacy)
+                match = "yes" if _same_edges(edges, ledges) else "NO"
+                legacy_s = f"{t_legacy:.3f}"
+            elif last_legacy:
+                n0, t0_legacy = last_legacy
+                t_legacy = t0_legacy * (n * (n - 1)) / (n0 * (n0 - 1))
+                legacy_s = f"~{t_legacy:.1f}"
+            else:
+                t_legacy, legacy_s = float("nan"), "n/a"
+            print(f"{n:>6} {legacy_s:>12} {t_np:>10.4f} {t_legacy / max(t_np, 1e-9):>8.0f}x  {match}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
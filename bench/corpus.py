@@ -0,0 +1,63 @@
+"""Synthetic Japanese/English study-note corpora for benchmarks (deterministic per seed)."""
+import random
+from typing import Dict, List
+
+TOPICS_JA = {
+    "線形代数": ["行列", "固有値", "固有ベクトル", "対角化", "行列式", "線形写像", "基底", "階数"],
+    "微分積分": ["極限", "導関数", "積分", "テイラー展開", "偏微分", "重積分", "級数", "連続性"],
+    "確率統計": ["確率変数", "期待値", "分散", "正規分布", "ベイズの定理", "推定", "検定", "尤度"],
+    "物理": ["運動方程式", "エネルギー保存", "電場", "磁場", "波動", "熱力学", "エントロピー", "量子"],
+    "情報科学": ["アルゴリズム", "計算量", "グラフ", "動的計画法", "ハッシュ", "探索", "ソート", "再帰"],
+}
+TOPICS_EN = {
+    "linear algebra": ["matrix", "eigenvalue", "eigenvector", "diagonalization", "determinant", "basis", "rank"],
+    "calculus": ["limit", "derivative", "integral", "Taylor series", "partial derivative", "convergence"],
+    "statistics": ["random variable", "expectation", "variance", "normal distribution", "Bayes theorem", "likelihood"],
+    "physics": ["Newton's law", "energy conservation", "electric field", "wave", "thermodynamics", "entropy"],
+    "computer science": ["algorithm", "complexity", "graph", "dynamic programming", "hashing", "recursion"],
+}
+TEMPLATES_JA = [
+    "{a}とは{b}を用いて説明できる。",
+    "{a}の性質として{b}が重要である。",
+    "例題: {a}を求めるには、まず{b}を確認する。",
+    "{a}と{b}の関係を整理しておくこと。",
+    "注意: {a}は{b}と混同しやすい。",
+]
+TEMPLATES_EN = [
+    "The {a} can be explained in terms of the {b}.",
+    "An important property of the {a} is the {b}.",
+    "Example: to compute the {a}, first check the {b}.",
+    "Note how the {a} relates to the {b}.",
+    "Careful: the {a} is easily confused with the {b}.",
+]
+
+
+def make_corpus(n: int, chars: int = 2000, lang: str = "mixed", seed: int = 0) -> List[Dict]:
+    """`n` notes as {id, text, meta} of about `chars` characters; lang is "ja", "en" or "mixed"."""
+    rng = random.Random(seed)
+    docs: List[Dict] = []
+    for i in range(n):
+        use_ja = lang == "ja" or (lang == "mixed" and i % 2 == 0)
+        topics, templates = (TOPICS_JA, TEMPLATES_JA) if use_ja else (TOPICS_EN, TEMPLATES_EN)
+        topic = rng.choice(list(topics))
+        sentences = [f"# {topic} {i}"]
+        size = len(sentences[0])
+        while size < chars:
+            # Mostly on-topic terms, sometimes borrowed from another topic
+            pool = topics[topic] if rng.random() < 0.8 else topics[rng.choice(list(topics))]
+            s = rng.choice(templates).format(a=rng.choice(pool), b=rng.choice(pool))
+            sentences.append(s)
+            size += len(s) + 1
+        name = f"note_{i:05d}.md"
+        docs.append({"id": f"{name}#bench", "text": "\n".join(sentences), "meta": {"title": name, "topic": topic}})
+    return docs
+
+
+def make_queries(n: int, lang: str = "mixed", seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        topics = TOPICS_JA if (lang == "ja" or (lang == "mixed" and i % 2 == 0)) else TOPICS_EN
+        topic = rng.choice(list(topics))
+        out.append(f"{rng.choice(topics[topic])} {rng.choice(topics[topic])} {i}")
+    return out
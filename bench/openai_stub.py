@@ -0,0 +1,153 @@
+"""Local stand-in for the OpenAI embeddings and chat endpoints (for benchmarks and offline runs).
+
+Embeddings are deterministic (hashed character n-grams, see services/local_embed.py, so similar
+texts get similar vectors); chat returns canned gaps/quiz JSON with as many questions as the
+system prompt asks for. Latency and HTTP 429 responses can be injected.
+
+Usage: python bench/openai_stub.py [--port 8765] [--latency-ms 50] [--error-rate 0.05]
+then   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run app/streamlit_app.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services import local_embed  # noqa: E402
+
+STATS = {"embeddings": 0, "embedding_inputs": 0, "chat": 0, "rate_limited": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        STATS[key] += n
+
+
+def _chat_content(messages: List[Dict]) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+    m = re.search(r"クイズ(\d+)問", system)
+    n = int(m.group(1)) if m else 3
+    tag = hashlib.sha1(user.encode("utf-8")).hexdigest()[:6]
+    quiz = [
+        {
+            "question": f"設問 {tag}-{i + 1}: 抜粋の要点はどれか",
+            "choices": ["選択肢A", "選択肢B", "選択肢C", "選択肢D"],
+            "answer": "A",
+            "explanation": f"抜粋 {tag} に基づく解説",
+        }
+        for i in range(n)
+    ]
+    gaps = [f"不足ポイント {tag}-{i + 1}" for i in range(3)]
+    return json.dumps({"gaps": gaps, "quiz": quiz}, ensure_ascii=False)
+
+
+def make_handler(latency_ms: float, error_rate: float, dim: int, seed: int = 0):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; without this, Nagle + delayed ACK add ~40 ms per call
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):  # keep benchmark output clean
+            pass
+
+        def _send(self, code: int, body: Dict, headers: Dict[str, str] = None) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            with rng_lock:
+                delay = max(0.0, rng.gauss(latency_ms, latency_ms * 0.2)) / 1000.0
+                limited = rng.random() < error_rate
+            time.sleep(delay)
+            if limited:
+                _count("rate_limited")
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                    {"retry-after-ms": "50"},
+                )
+                return
+            if self.path.endswith("/embeddings"):
+                inputs = req.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+                _count("embeddings")
+                _count("embedding_inputs", len(inputs))
+                vecs = local_embed.embed(inputs, dim=dim)
+                tokens = sum(len(t) // 2 + 1 for t in inputs)
+                self._send(200, {
+                    "object": "list",
+                    "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vecs)],
+                    "model": req.get("model", "stub"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+            elif self.path.endswith("/chat/completions"):
+                _count("chat")
+                content = _chat_content(req.get("messages", []))
+                prompt_tokens = sum(len(m.get("content", "")) // 2 + 1 for m in req.get("messages", []))
+                self._send(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": req.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(content) // 2,
+                        "total_tokens": prompt_tokens + len(content) // 2,
+                    },
+                })
+            else:
+                self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    return Handler
+
+
+def start_stub(
+    port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0, dim: int = 1536
+) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve the stub from a daemon thread; returns (server, base_url). Port 0 picks a free port."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, error_rate, dim))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--dim", type=int, default=1536)
+    args = ap.parse_args()
+    server, url = start_stub(args.port, args.latency_ms, args.error_rate, args.dim)
+    print(f"OpenAI stub listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""End-to-end benchmarks against the local OpenAI stub; results are written as JSON.
+
+Measures ingest throughput (`upsert_texts`), `search` latency percentiles per mode,
+`build_graph` time and HTML size against n, and quiz generation end to end.
+
+Usage: python bench/run_bench.py [--sizes 100 500 2000] [--latency-ms 30] [--error-rate 0.02]
+                                 [--out bench/results] [--compare bench/results/<previous>.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "app"))
+sys.path.insert(0, HERE)
+
+from corpus import make_corpus, make_queries  # noqa: E402
+from openai_stub import STATS, start_stub  # noqa: E402
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run(args) -> Dict:
+    server, base_url = start_stub(0, args.latency_ms, args.error_rate, args.dim)
+    work = tempfile.mkdtemp(prefix="kmap-bench-")
+    # Configure before the services modules read their settings at import time
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "stub",
+        "EMBED_PROVIDER": "openai",
+        "EMBED_CACHE_PATH": os.path.join(work, "embeddings.sqlite3"),
+        "EMBED_CACHE_ENABLED": "0",
+        "LLM_CACHE_ENABLED": "0",
+    })
+    # The stub has no account limits: leave the scheduler's buckets open unless asked otherwise
+    for name in ("OPENAI_EMBED_RPM", "OPENAI_EMBED_TPM", "OPENAI_CHAT_RPM", "OPENAI_CHAT_TPM"):
+        os.environ.setdefault(name, "0")
+    from services import vector_store
+    from services.chunking import chunk_items
+    from services.context import build_context
+    from services.graph import build_graph
+    from services.insights import generate_sharded
+
+    out: Dict = {
+        "commit": _git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "ingest": [],
+        "search": [],
+        "graph": [],
+        "insights": [],
+    }
+    try:
+        for i, n in enumerate(args.sizes):
+            # A new persist dir per size (init_store reopens when the directory changes)
+            vector_store.init_store(os.path.join(work, f"chroma_{i}_{n}"))
+            docs = make_corpus(n, chars=args.chars, lang=args.lang)
+            chunks = list(chunk_items(docs))
+            t0 = time.perf_counter()
+            vector_store.upsert_texts(chunks)
+            dt = time.perf_counter() - t0
+            out["ingest"].append({"n": n, "chunks": len(chunks), "seconds": dt, "docs_per_sec": n / dt})
+            print(f"ingest   n={n:<6} chunks={len(chunks):<6} {n / dt:8.1f} docs/s")
+
+            for mode in ("vector", "hybrid", "lexical"):
+                lat = []
+                for q in make_queries(args.queries, lang=args.lang, seed=n):
+                    t0 = time.perf_counter()
+                    vector_store.search(f"{q} {mode}", top_k=15, mode=mode)
+                    lat.append((time.perf_counter() - t0) * 1000)
+                row = {"n": n, "mode": mode, "p50_ms": _pct(lat, 0.5), "p95_ms": _pct(lat, 0.95)}
+                out["search"].append(row)
+                print(f"search   n={n:<6} {mode:<8} p50={row['p50_ms']:7.1f} ms  p95={row['p95_ms']:7.1f} ms")
+
+            for use_index in (False, True):
+                results = vector_store.list_items(min(n * 4, args.graph_max))
+                t0 = time.perf_counter()
+                html = build_graph(results, use_index=use_index)
+                dt = time.perf_counter() - t0
+                out["graph"].append({"n": n, "nodes": len(results), "use_index": use_index, "seconds": dt, "html_bytes": len(html)})
+                print(f"graph    n={n:<6} nodes={len(results):<6} index={use_index!s:<5} {dt:7.3f} s  {len(html) / 1024:8.1f} KiB")
+
+            results = vector_store.search(make_queries(1, lang=args.lang, seed=n + 7)[0], top_k=10)
+            t0 = time.perf_counter()
+            ctx = build_context(results, "benchmark")
+            t_ctx = time.perf_counter() - t0
+            data = generate_sharded("ベンチマーク用の要約", ctx["snippets"], quiz_n=args.quiz_n, sources=ctx["sources"])
+            dt = time.perf_counter() - t0
+            out["insights"].append({
+                "n": n, "seconds": dt, "context_seconds": t_ctx, "context_tokens": ctx["tokens"],
+                "shards": data["_usage"].get("shards"), "questions": len(data.get("quiz", [])),
+            })
+            print(f"insights n={n:<6} {dt:7.3f} s  (context {t_ctx:.3f} s, {ctx['tokens']} tokens, {len(data.get('quiz', []))} questions)")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+    out["stub"] = dict(STATS)
+    return out
+
+
+def compare(cur: Dict, prev: Dict) -> None:
+    """Print current/previous ratios for the headline numbers (matching n / mode / index)."""
+    print(f"\nvs {prev.get('commit')} ({prev.get('created_at')}): ratio = current / previous")
+    sections = [
+        ("ingest", ("n",), "docs_per_sec"),
+        ("search", ("n", "mode"), "p95_ms"),
+        ("graph", ("n", "use_index"), "seconds"),
+        ("insights", ("n",), "seconds"),
+    ]
+    for name, keys, metric in sections:
+        old = {tuple(r[k] for k in keys): r for r in prev.get(name, [])}
+        for r in cur.get(name, []):
+            o = old.get(tuple(r[k] for k in keys))
+            if o and o.get(metric):
+                label = " ".join(f"{k}={r[k]}" for k in keys)
+                print(f"  {name:<8} {label:<28} {metric:<13} {r[metric] / o[metric]:6.2f}x")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="End-to-end benchmarks against a local OpenAI stub")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000])
+    ap.add_argument("--chars", type=int, default=2000, help="characters per synthetic note")
+    ap.add_argument("--lang", choices=["ja", "en", "mixed"], default="mixed")
+    ap.add_argument("--queries", type=int, default=50, help="queries per search mode")
+    ap.add_argument("--graph-max", type=int, default=2000, help="max nodes passed to build_graph")
+    ap.add_argument("--quiz-n", type=int, default=8)
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--out", default=os.path.join(HERE, "results"))
+    ap.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    args = ap.parse_args()
+
+    res = run(args)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{res['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    print(f"\nwrote {path}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(res, json.load(f))
+
+
+if __name__ == "__main__":
+    main()